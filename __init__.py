@@ -1,2 +1,2 @@
-from .markdown import parse_markdown
+from .markdown import parse_markdown, parse_many
 from .errors import BiberException, ThemeException, ParsingException
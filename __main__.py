@@ -1,12 +1,24 @@
 import os
 import sys
 import locale
+import pickle
+import argparse
+import tempfile
+import threading
 import importlib
-import datetime
+import time
+import io
+import concurrent.futures
 
 from . import errors as biber_errors
 from . import config as biber_config
 from . import posts as biber_posts
+from . import manifest as biber_manifest
+from . import cache as biber_cache
+from . import profiler as biber_profiler
+from . import watch as biber_watch
+from . import serve as biber_serve
+from . import feed as biber_feed
 from . import markdown, routes, utils, pgp
 
 def list_importable_modules(dir):
@@ -27,7 +39,14 @@ def load_plugins_from_dir(dir):
     sys.path.insert(0, dir)
     
     for name in list_importable_modules(dir):
-        mod = importlib.import_module(name)
+        mod = sys.modules.get(name)
+        
+        # Loading the plugins again in watch or serve mode
+        # has to pick up the changes made to them
+        if mod is not None and os.path.dirname(getattr(mod, "__file__", None) or "").startswith(os.path.abspath(dir)):
+            mod = importlib.reload(mod)
+        else:
+            mod = importlib.import_module(name)
         
         # check if the plugin has all the necessary attributes
         if not hasattr(mod, "generate_content") or not callable(mod.generate_content):
@@ -38,6 +57,8 @@ def load_plugins_from_dir(dir):
             raise biber_errors.BiberException(f"Plugin {name} has no EXTRA_STYLESHEETS attribute")
         if not hasattr(mod, "EXTRA_FILES"):
             raise biber_errors.BiberException(f"Plugin {name} has no EXTRA_FILES attribute")
+        if hasattr(mod, "RENDERERS") and not isinstance(mod.RENDERERS, dict):
+            raise biber_errors.BiberException(f"Plugin {name} has an invalid RENDERERS attribute")
         
         ret[name] = mod
     
@@ -45,91 +66,756 @@ def load_plugins_from_dir(dir):
     
     return ret
 
-def create_posts(config, plugins, posts):
-    for post in posts:
+def load_plugins(config):
+    if config["blog"]["plugins"] is None:
+        return {}
+    
+    plugins = load_plugins_from_dir(config["blog"]["plugins"])
+    
+    # Plugins may bring their own element types
+    # together with the functions that render them
+    for mod in plugins.values():
+        for element_type, renderer in getattr(mod, "RENDERERS", {}).items():
+            config["blog"]["theme"].register_renderer(element_type, renderer)
+    
+    return plugins
+
+# With refresh the cached trees and bodies are ignored
+# and replaced, for when the cache itself went stale
+def render_body(config, plugins, cache, renderer_digest, content, timing, refresh=False):
+    theme = config["blog"]["theme"]
+    start = time.perf_counter()
+    key = biber_cache.make_key(renderer_digest, markdown.tree_key(content))
+    data = None if refresh else cache.get("bodies", key)
+    
+    if data is not None:
         try:
-            elements = markdown.parse_markdown(post.get_markdown())
-        except markdown.ParsingException as e:
-            raise biber_errors.BiberException(f"Parsing error in {post.filename}: {e}")
-        
-        config["blog"]["theme"].generate_post(post, elements, config, plugins)
+            body = pickle.loads(data)
+            timing.render = time.perf_counter() - start
+            return body
+        except Exception:
+            pass
+    
+    tree = markdown.parse_markdown_cached(content, cache, refresh)
+    timing.parse = time.perf_counter() - start
+    start = time.perf_counter()
+    body = theme.render_body(tree, plugins)
+    cache.put("bodies", key, pickle.dumps(body, protocol=pickle.HIGHEST_PROTOCOL))
+    timing.render = time.perf_counter() - start
+    return body
 
-def generate_feed(config, posts):
+# Like render_body() for the markdown of a post, errors
+# in the markdown are reported with the name of the post
+def load_body(config, plugins, cache, renderer_digest, post, timing=None, refresh=False):
+    if timing is None:
+        timing = biber_profiler.PostTiming(post.filename)
+    
+    try:
+        return render_body(config, plugins, cache, renderer_digest, post.get_markdown(), timing, refresh)
+    except biber_errors.ParsingException as e:
+        raise biber_errors.BiberException(f"Parsing error in {post.filename}: {e}")
+    except RecursionError:
+        # Rendering recurses into the element tree
+        raise biber_errors.BiberException(f"Elements nested too deeply in {post.filename}")
+
+def render_post(config, plugins, cache, renderer_digest, post, assets=None, refresh=False):
+    timing = biber_profiler.PostTiming(post.filename)
+    body = load_body(config, plugins, cache, renderer_digest, post, timing, refresh)
+    start = time.perf_counter()
+    images, used_plugins = config["blog"]["theme"].generate_post(post, body, config, plugins, assets)
+    timing.write = time.perf_counter() - start
+    timing.finish()
+    
+    return images, used_plugins, timing
+
+# Every worker process of the pool loads its own copy
+# of the config, the plugins and the theme once and
+# then renders the posts it gets handed
+worker_config = None
+worker_plugins = None
+worker_cache = None
+worker_renderer_digest = None
+worker_refresh = False
+
+def init_worker(config_file, renderer_digest, refresh):
+    global worker_config, worker_plugins, worker_cache, worker_renderer_digest, worker_refresh
+    set_locale()
+    worker_config = biber_config.parse(config_file)
+    worker_plugins = load_plugins(worker_config)
+    worker_cache = biber_cache.open_cache(worker_config)
+    worker_renderer_digest = renderer_digest
+    worker_refresh = refresh
+    worker_config["blog"]["theme"].initialize(worker_config, False)
+
+# The files to copy are sent back to the main process
+# which copies them in its utils.CopyQueue
+def render_post_in_worker(post):
+    jobs = utils.CopyJobs()
+    images, used_plugins, timing = render_post(worker_config, worker_plugins, worker_cache, worker_renderer_digest, post, jobs, worker_refresh)
+    return images, used_plugins, timing, jobs
+
+# The assets of the posts are copied by the given utils.CopyQueue
+# while rendering goes on, if none is given create_posts() waits
+# for its own queue before returning. refresh renders the posts
+# without the cache, see render_body().
+def create_posts(config, plugins, cache, posts, manifest, profiler, force=False, jobs=1, config_file=None, assets=None, refresh=False):
+    renderer_digest = biber_manifest.renderer_digest(config["blog"]["theme"], plugins)
+    own_assets = assets is None
+    dirty = []
+    
+    if own_assets:
+        assets = utils.CopyQueue()
+    
+    for post in posts:
+        if force or manifest.is_dirty(post, config["blog"]["out"]):
+            dirty.append(post)
+    
+    if jobs > 1 and len(dirty) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=init_worker,
+            initargs=(config_file, renderer_digest, refresh)
+        ) as executor:
+            chunksize = max(1, len(dirty) // (jobs * 4))
+            results = executor.map(render_post_in_worker, dirty, chunksize=chunksize)
+            
+            # The assets every post used are merged back into the manifest here
+            for post, (images, used_plugins, timing, copies) in zip(dirty, results):
+                manifest.update(post, images, used_plugins)
+                profiler.record_post(timing)
+                
+                for src, dst, mode in copies:
+                    assets.copy(src, dst, mode)
+    else:
+        for post in dirty:
+            images, used_plugins, timing = render_post(config, plugins, cache, renderer_digest, post, assets, refresh)
+            manifest.update(post, images, used_plugins)
+            profiler.record_post(timing)
+    
+    if own_assets:
+        assets.wait()
+
+# The feed reuses the bodies that were rendered for the post
+# pages, they are only rendered again if the cache lost them
+def generate_feed(config, plugins, cache, posts):
     if not config.has_feed():
         return
-    if config["blog"]["domain"] is None:
-        raise biber_errors.BiberException("Configuration is set to generate an RSS feed but no domain is given")
     
-    out_file = utils.join_paths(
-        config["blog"]["out"],
-        routes.RSS_FEED
+    renderer_digest = biber_manifest.renderer_digest(config["blog"]["theme"], plugins)
+    biber_feed.generate_feed(
+        config,
+        reversed(posts[-config["feed"]["size"]:]),
+        lambda post: load_body(config, plugins, cache, renderer_digest, post).html
     )
-    now = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S %z")
-    
-    with utils.create_open(out_file) as f:
-        f.write('<?xml version="1.0" encoding="UTF-8" ?>')
-        f.write('<rss version="2.0">')
-        f.write('<channel>')
-        f.write(f'<title>{config["blog"]["title"]}</title>')
-        f.write('<description></description>')
-        f.write(f'<lastBuildDate>{now}</lastBuildDate>')
-        f.write(f'<link>{config["blog"]["domain"]}{routes.RSS_FEED}</link>')
-        f.write(f'<pubDate>{now}</pubDate>')
-        f.write('<generator>biber 2.0</generator>')
-        
-        for post in posts:
-            date = post.metadata.date.astimezone(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S %z")
-            url = config["blog"]["domain"] + routes.post_page(post)
-            f.write('<item>')
-            f.write(f'<title>{post.metadata.title}</title>')
-            f.write(f'<description>{post.metadata.title}: <a href="{url}">{url}</a></description>')
-            f.write(f'<pubDate>{date}</pubDate>')
-            
-            for cat in post.metadata.categories:
-                f.write(f'<category>{cat}</category>')
-            
-            f.write(f'<author>{post.metadata.author}</author>')
-            f.write(f'<link>{url}</link>')
-            f.write('</item>')
-            
-        f.write('</channel>')
-        f.write('</rss>')
 
-#TODO: command line argument to use locale of system not en_US
-#TODO: command line argument -f to force regeneration
-def main():
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <config file>")
-        exit(1)
+def parse_args():
+    parser = argparse.ArgumentParser(prog="biber")
+    parser.add_argument("config", help="config file")
+    parser.add_argument("-f", "--force", action="store_true", help="render all posts even if they have not changed")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N", help="render posts in N worker processes (0: one per CPU)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("-w", "--watch", action="store_true", help="keep running and rebuild whatever is affected when an input changes")
+    mode.add_argument("-s", "--serve", action="store_true", help="serve the blog over HTTP and render pages on request instead of building it")
+    mode.add_argument("--compile-templates", action="store_true", help="compile the templates into the cache and exit")
+    parser.add_argument("--bind", default="127.0.0.1", metavar="ADDRESS", help="address the server listens on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="port the server listens on (default: 8000)")
+    parser.add_argument("--profile", action="store_true", help="print how long every stage of the build took")
+    parser.add_argument("--profile-top", type=int, default=10, metavar="N", help="list the N slowest posts in the profile (default: 10)")
+    parser.add_argument("--profile-json", metavar="FILE", help="write the profile as JSON to FILE")
+    parser.add_argument("--profile-trace", metavar="FILE", help="write the profile in Chrome's trace event format to FILE")
+    args = parser.parse_args()
+    
+    if args.jobs < 0:
+        parser.error("--jobs must not be negative")
+    elif args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+    
+    if args.profile_top < 0:
+        parser.error("--profile-top must not be negative")
     
+    return args
+
+#TODO: command line argument to use locale of system not en_US
+def set_locale():
     try:
         locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
     except locale.Error:
         locale.setlocale(locale.LC_ALL, '')
+
+# The numbers of the pages of a listing that show something
+# different than in the last build. Besides its posts every
+# page shows the links to its neighbours, get_route(number, count)
+# gives the route of a page.
+def get_dirty_pages(config, manifest, kind, pages, get_route, force=False):
+    ret = []
+    count = len(pages)
+    
+    for number, page in enumerate(pages, 1):
+        page_routes = [get_route(n, count) for n in range(max(1, number - 1), min(count, number + 1) + 1)]
+        signature = biber_posts.listing_signature(page, *page_routes)
+        
+        if manifest.is_page_dirty(get_route(number, count), kind, signature, config["blog"]["out"]) or force:
+            ret.append(number)
+    
+    return ret
+
+def get_dirty_postlists(config, manifest, posts, force=False):
+    pages = biber_posts.paginate(posts, config["blog"]["page-size"])
+    return get_dirty_pages(config, manifest, "postlist", pages, routes.get_postlist_page, force)
+
+def get_dirty_catlists(config, manifest, categories, force=False):
+    ret = {}
+    
+    for cat in categories:
+        pages = biber_posts.paginate(categories[cat], config["blog"]["page-size"])
+        numbers = get_dirty_pages(config, manifest, "catlist", pages, lambda number, count: routes.get_catlist_page(cat, number, count), force)
+        
+        if numbers:
+            ret[cat] = numbers
     
-    config = biber_config.parse(sys.argv[1])
-    posts = biber_posts.create_post_listing(config, True)
+    return ret
+
+def setup(args, profiler):
+    with profiler.stage("config"):
+        config = biber_config.parse(args.config)
+    
+    with profiler.stage("plugins"):
+        plugins = load_plugins(config)
+    
+    with profiler.stage("manifest"):
+        manifest = biber_manifest.load(config, args.config, plugins)
+        cache = biber_cache.open_cache(config)
+    
+    # Only watch mode has to notice changed templates
+    with profiler.stage("theme"):
+        config["blog"]["theme"].initialize(config, args.watch)
+    
+    return config, plugins, manifest, cache
+
+def build(args, config, plugins, manifest, cache, posts, profiler):
+    assets = utils.CopyQueue()
+    
+    with profiler.stage("posts"):
+        # -f must not take stale output from the cache either
+        create_posts(config, plugins, cache, posts, manifest, profiler, args.force, args.jobs, args.config, assets, args.force)
+        
+        # Posts that did not change still need up to date plugin
+        # files, only the stale ones are copied
+        config["blog"]["theme"].copy_plugin_files(config, plugins, manifest.get_used_plugins(), assets.copy)
+    
+    with profiler.stage("cache eviction"):
+        cache.evict()
+    
+    with profiler.stage("pages"):
+        categories = biber_posts.CategoryIndex(posts)
+        postlists = get_dirty_postlists(config, manifest, posts, args.force)
+        catlists = get_dirty_catlists(config, manifest, categories, args.force)
+        config["blog"]["theme"].generate_pages(config, posts, categories, postlists, catlists)
+        manifest.save()
+    
+    with profiler.stage("feed"):
+        generate_feed(config, plugins, cache, posts)
+    
+    #TODO: sign stuff
+    
+    with profiler.stage("pgp"):
+        for social in config["socials"]:
+            if social.name == "E-Mail":
+                key = social.url.split("/")[-1].split(".")[0]
+                pgp.dump_public_key(
+                    config,
+                    utils.join_paths(config["blog"]["out"], social.url),
+                    key
+                )
+    
+    # The assets were copied in the background all along
+    with profiler.stage("assets"):
+        assets.wait()
+
+def add_post_dependencies(graph, post, manifest):
+    filename = os.path.abspath(post.filename)
+    
+    # ("listing", filename) stands for the index, the post listing,
+    # the category pages and the feed. They are only generated
+    # again if the metadata of the post changed.
+    graph.add(filename, ("post", filename))
+    graph.add(filename, ("listing", filename))
+    
+    for input_file in manifest.get_files(post):
+        graph.add(input_file, ("post", filename))
+
+def create_dependency_graph(config, posts, manifest):
     theme = config["blog"]["theme"]
-    plugins = {}
+    graph = biber_watch.DependencyGraph()
+    
+    for template in theme.get_template_files():
+        page = theme.TEMPLATE_PAGES.get(os.path.basename(template))
+        
+        if page is not None:
+            graph.add(template, ("template", page))
+    
+    for post in posts:
+        add_post_dependencies(graph, post, manifest)
+    
+    return graph
+
+def create_watcher(args, config):
+    theme = config["blog"]["theme"]
+    dirs = [
+        config["blog"]["in"],
+        theme.get_templates_dir(),
+        theme.get_static_dir(),
+    ]
     
     if config["blog"]["plugins"] is not None:
-        plugins = load_plugins_from_dir(config["blog"]["plugins"])
+        dirs.append(config["blog"]["plugins"])
     
-    theme.initialize()
-    create_posts(config, plugins, posts)
-    theme.generate_pages(config, posts)
-    generate_feed(config, reversed(posts[-config["feed"]["size"]:]))
+    return biber_watch.create_watcher(
+        dirs,
+        [args.config],
+        [config["blog"]["out"], config["cache"]["dir"]]
+    )
+
+# Changes to the config or the plugins cannot be
+# applied incrementally, everything has to be loaded again
+def needs_reload(args, config, changed):
+    dirs = [os.path.abspath(args.config)]
     
-    #TODO: sign stuff
+    if config["blog"]["plugins"] is not None:
+        dirs.append(os.path.abspath(config["blog"]["plugins"]))
     
-    for social in config["socials"]:
-        if social.name == "E-Mail":
-            key = social.url.split("/")[-1].split(".")[0]
-            pgp.dump_public_key(
-                config,
-                utils.join_paths(config["blog"]["out"], social.url),
-                key
+    return any(biber_watch.is_below(path, dirs) for path in changed)
+
+def post_filename(config, path):
+    # Keep the filenames in the same form as create_post_listing()
+    return os.path.join(
+        config["blog"]["in"],
+        os.path.relpath(path, os.path.abspath(config["blog"]["in"]))
+    )
+
+# Reads the header of a changed post file again. If only the
+# body changed the old post stays in the listing, its body
+# might have moved though. Otherwise the new post, or None if
+# the file is gone, replaces it and the listing changed.
+def reload_post(config, old, filename):
+    new = None
+    
+    if os.path.isfile(filename):
+        new = biber_posts.Post(post_filename(config, filename))
+        new.parse_metadata()
+    
+    if old is not None and new is not None and old.metadata == new.metadata:
+        old.start_pos = new.start_pos
+        return old, False
+    
+    return new, True
+
+class Site:
+    """
+    Everything watch mode keeps in memory between
+    two rebuilds: the parsed config, the loaded plugins
+    and theme, the post listing and the dependency graph.
+    """
+    def __init__(self, args, profiler):
+        self.args = args
+        self.config, self.plugins, self.manifest, self.cache = setup(args, profiler)
+        self.posts = biber_posts.create_post_listing(self.config)
+        build(args, self.config, self.plugins, self.manifest, self.cache, self.posts, profiler)
+        self.graph = create_dependency_graph(self.config, self.posts, self.manifest)
+        self.unsaved = False
+    
+    def save(self):
+        if self.unsaved:
+            self.manifest.save()
+            self.unsaved = False
+    
+    def rebuild(self, changed):
+        theme = self.config["blog"]["theme"]
+        static_dir = os.path.abspath(theme.get_static_dir())
+        by_file = { os.path.abspath(post.filename) : post for post in self.posts }
+        affected = self.graph.affected(changed)
+        
+        for path in changed:
+            if path not in by_file and biber_posts.is_post_file(self.config, path):
+                affected.add(("post", path))
+                affected.add(("listing", path))
+            elif biber_watch.is_below(path, [static_dir]):
+                affected.add(("static",))
+        
+        render = set()
+        pages = set()
+        listing_changed = False
+        
+        for output in affected:
+            if output[0] == "post":
+                render.add(output[1])
+            elif output[0] == "template":
+                if output[1] == "post":
+                    render.update(by_file)
+                else:
+                    pages.add(output[1])
+            elif output[0] == "static":
+                pages.add("static")
+            elif output[0] == "listing":
+                filename = output[1]
+                old = by_file.get(filename)
+                new, changed_listing = reload_post(self.config, old, filename)
+                
+                if not changed_listing:
+                    continue
+                
+                listing_changed = True
+                
+                if old is not None:
+                    self.posts.remove(old)
+                    del by_file[filename]
+                    self.graph.remove_output(("post", filename))
+                    self.graph.remove_output(("listing", filename))
+                
+                if new is not None:
+                    self.posts.append(new)
+                    by_file[filename] = new
+        
+        # The manifest must not keep the digests of the old templates,
+        # otherwise the next build renders everything once more
+        if any(output[0] == "template" for output in affected):
+            self.manifest.global_digest, self.manifest.page_digests = biber_manifest.get_digests(self.config, self.args.config)
+        
+        if listing_changed:
+            biber_posts.sort_posts(self.posts)
+            biber_posts.assign_ids(self.config, self.posts)
+            pages.update(["index", "feed"])
+        
+        to_render = [by_file[filename] for filename in render if filename in by_file]
+        categories = biber_posts.CategoryIndex(self.posts)
+        postlists = []
+        catlists = {}
+        
+        if to_render:
+            create_posts(self.config, self.plugins, self.cache, to_render, self.manifest, biber_profiler.Profiler(), True, self.args.jobs, self.args.config)
+            
+            for post in to_render:
+                add_post_dependencies(self.graph, post, self.manifest)
+            
+            # The feed might carry the bodies that changed
+            if self.config["feed"]["content"] == "full":
+                pages.add("feed")
+        
+        # The signatures tell which pages of the listings are affected
+        # by the changed listing, a changed template affects all of them
+        if listing_changed or "postlist" in pages:
+            postlists = get_dirty_postlists(self.config, self.manifest, self.posts, "postlist" in pages)
+        if listing_changed or "catlist" in pages:
+            catlists = get_dirty_catlists(self.config, self.manifest, categories, "catlist" in pages)
+        
+        if "index" in pages:
+            theme.generate_index(self.config, self.posts, categories)
+        if postlists:
+            theme.generate_postlist(self.config, self.posts, postlists)
+        if catlists:
+            theme.generate_catlists(self.config, categories, catlists)
+        if "static" in pages:
+            theme.copy_static_files(self.config)
+        if "feed" in pages:
+            generate_feed(self.config, self.plugins, self.cache, self.posts)
+        
+        # Saving the manifest takes long on big blogs, watch()
+        # does it once the changes stop coming in
+        if to_render or postlists or catlists:
+            self.unsaved = True
+        
+        return len(to_render), len(pages - {"postlist", "catlist"}) + len(postlists) + sum(map(len, catlists.values()))
+
+# Errors that are expected while someone is still editing the
+# posts, like a typo in a plugin name or an image that has not
+# been saved yet. They must not end watch or serve mode.
+WATCH_ERRORS = (biber_errors.BiberException, biber_errors.ThemeException, OSError)
+
+# How many seconds without changes until watch mode saves the manifest
+MANIFEST_SAVE_DELAY = 1.0
+
+def watch(args, site):
+    watcher = create_watcher(args, site.config)
+    print("Watching for changes, press Ctrl+C to stop", file=sys.stderr)
+    
+    try:
+        while True:
+            changed = watcher.wait(MANIFEST_SAVE_DELAY if site.unsaved else None)
+            
+            if not changed:
+                site.save()
+                continue
+            
+            start = time.perf_counter()
+            
+            try:
+                if needs_reload(args, site.config, changed):
+                    site.save()
+                    site = Site(args, biber_profiler.Profiler())
+                    watcher = create_watcher(args, site.config)
+                    print(f"Configuration or plugins changed, rebuilt everything in {1000 * (time.perf_counter() - start):.0f} ms", file=sys.stderr)
+                    continue
+                
+                posts, pages = site.rebuild(changed)
+            except WATCH_ERRORS as e:
+                # Keep watching, the next save probably fixes it
+                print(e, file=sys.stderr)
+                continue
+            
+            if posts or pages:
+                print(f"Rebuilt {posts} posts and {pages} pages in {1000 * (time.perf_counter() - start):.0f} ms", file=sys.stderr)
+    finally:
+        site.save()
+
+# Whether filename is one of files, both relative to the same folder
+def is_listed(filename, files):
+    filename = os.path.normpath(filename)
+    return any(os.path.normpath(file.lstrip("/")) == filename for file in files)
+
+class Preview:
+    """
+    Renders pages when they are requested instead of
+    writing them to the output directory. Rendered pages
+    are kept in memory until a background thread notices
+    that one of their inputs changed.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.pages = biber_serve.PageCache()
+        self.load()
+    
+    def load(self):
+        config = biber_config.parse(self.args.config)
+        plugins = load_plugins(config)
+        posts = biber_posts.create_post_listing(config)
+        config["blog"]["theme"].initialize(config)
+        
+        self.config = config
+        self.plugins = plugins
+        self.cache = biber_cache.open_cache(config)
+        self.renderer_digest = biber_manifest.renderer_digest(config["blog"]["theme"], plugins)
+        self.set_posts(posts)
+    
+    def set_posts(self, posts):
+        self.posts = posts
+        self.categories = biber_posts.CategoryIndex(posts)
+        self.by_file = { os.path.abspath(post.filename) : post for post in posts }
+        self.pages.clear()
+    
+    def find_post(self, route):
+        for post in self.posts:
+            if route.startswith(routes.post_folder(post)):
+                return post
+        
+        return None
+    
+    def render_body(self, post):
+        return load_body(self.config, self.plugins, self.cache, self.renderer_digest, post)
+    
+    # Like the build only the images and attachments
+    # of a post are published next to it
+    def is_post_asset(self, post, name):
+        return is_listed(name, [*self.render_body(post).images, *post.metadata.attachment])
+    
+    def render_page(self, route):
+        theme = self.config["blog"]["theme"]
+        
+        if route == routes.HOME_PAGE:
+            return theme.render_index(self.config, self.posts, self.categories)
+        elif self.config.has_feed() and route in biber_feed.get_feed_routes(self.config):
+            f = io.StringIO()
+            biber_feed.write_feed(
+                f,
+                self.config,
+                route,
+                reversed(self.posts[-self.config["feed"]["size"]:]),
+                lambda post: self.render_body(post).html
             )
+            return f.getvalue()
+        
+        count = len(biber_posts.paginate(self.posts, self.config["blog"]["page-size"]))
+        
+        for number in range(1, count + 1):
+            if routes.get_postlist_page(number, count) == route:
+                return theme.render_postlist(self.config, self.posts, number)
+        
+        for cat in self.categories:
+            count = len(biber_posts.paginate(self.categories[cat], self.config["blog"]["page-size"]))
+            
+            for number in range(1, count + 1):
+                if routes.get_catlist_page(cat, number, count) == route:
+                    return theme.render_catlist(self.config, self.categories, cat, number)
+        
+        post = self.find_post(route)
+        
+        if post is not None and routes.post_page(post) == route:
+            f = io.StringIO()
+            theme.write_post_page(f, post, self.render_body(post), self.config, self.plugins)
+            return f.getvalue()
+        
+        for social in self.config["socials"]:
+            if social.name == "E-Mail" and utils.join_paths("/", social.url) == route:
+                with tempfile.TemporaryDirectory(prefix="biber-") as tmp:
+                    key_file = os.path.join(tmp, "key")
+                    pgp.dump_public_key(self.config, key_file, social.url.split("/")[-1].split(".")[0])
+                    
+                    with open(key_file) as f:
+                        return f.read()
+        
+        return None
+    
+    # Files are read from where they are and never copied
+    def find_file(self, route):
+        theme = self.config["blog"]["theme"]
+        post = self.find_post(route)
+        
+        if post is not None:
+            name = route[len(routes.post_folder(post)):]
+            
+            if not self.is_post_asset(post, name):
+                return None
+            
+            return biber_serve.resolve_file(os.path.dirname(post.filename), name)
+        
+        for name in self.plugins:
+            if route.startswith(routes.plugin_folder(name)):
+                mod = self.plugins[name]
+                filename = route[len(routes.plugin_folder(name)):]
+                
+                # Only the files a build copies, not the code of the plugins
+                if not is_listed(filename, [*mod.EXTRA_SCRIPTS, *mod.EXTRA_STYLESHEETS, *mod.EXTRA_FILES]):
+                    return None
+                
+                return biber_serve.resolve_file(theme.get_plugin_dir(self.config, name), filename)
+        
+        if route.startswith(routes.STATIC_FOLDER):
+            return biber_serve.resolve_file(theme.get_static_dir(), route[len(routes.STATIC_FOLDER):])
+        
+        return None
+    
+    def render(self, route):
+        if route.endswith("/"):
+            route += "index.html"
+        
+        with self.lock:
+            page = self.pages.get(route)
+            
+            if page is None:
+                html = self.render_page(route)
+                
+                if html is not None:
+                    page = (html.encode(), biber_serve.guess_type(route))
+                    self.pages.put(route, page)
+            
+            if page is not None:
+                return page
+            
+            path = self.find_file(route)
+        
+        if path is None:
+            return None
+        
+        with open(path, "rb") as f:
+            return (f.read(), biber_serve.guess_type(path))
+    
+    def invalidate(self, changed):
+        theme = self.config["blog"]["theme"]
+        template_files = set(map(os.path.abspath, theme.get_template_files()))
+        relist = False
+        
+        for path in changed:
+            if path in template_files:
+                self.pages.clear()
+                continue
+            
+            if not biber_posts.is_post_file(self.config, path):
+                continue
+            
+            old = self.by_file.get(path)
+            _, changed_listing = reload_post(self.config, old, path)
+            
+            if not changed_listing:
+                self.pages.discard(routes.post_page(old))
+                
+                if self.config["feed"]["content"] == "full":
+                    for route in biber_feed.get_feed_routes(self.config):
+                        self.pages.discard(route)
+                
+                continue
+            
+            # Posts were added, removed or changed their metadata,
+            # all listings and possibly the ids are affected
+            relist = True
+        
+        if relist:
+            self.set_posts(biber_posts.create_post_listing(self.config))
+    
+    def watch(self):
+        watcher = create_watcher(self.args, self.config)
+        
+        while True:
+            changed = watcher.wait()
+            
+            with self.lock:
+                try:
+                    if needs_reload(self.args, self.config, changed):
+                        self.load()
+                        watcher = create_watcher(self.args, self.config)
+                    else:
+                        self.invalidate(changed)
+                except WATCH_ERRORS as e:
+                    print(e, file=sys.stderr)
+
+def main():
+    args = parse_args()
+    set_locale()
+    
+    # Lets CI warm the cache before the actual builds
+    if args.compile_templates:
+        config = biber_config.parse(args.config)
+        config["blog"]["theme"].initialize(config, False)
+        config["blog"]["theme"].compile_templates()
+        return
+    
+    if args.serve:
+        preview = Preview(args)
+        threading.Thread(target=preview.watch, daemon=True).start()
+        
+        try:
+            biber_serve.serve(preview.render, args.bind, args.port)
+        except KeyboardInterrupt:
+            pass
+        
+        return
+    
+    profiler = biber_profiler.Profiler()
+    
+    if args.watch:
+        site = Site(args, profiler)
+    else:
+        config, plugins, manifest, cache = setup(args, profiler)
+        
+        with profiler.stage("post listing"):
+            posts = biber_posts.create_post_listing(config)
+        
+        build(args, config, plugins, manifest, cache, posts, profiler)
+    
+    totals = profiler.io_total()
+    print(f"{totals['files_written']} files written, {totals['files_copied']} copied, {totals['files_skipped']} unchanged", file=sys.stderr)
+    
+    if args.profile:
+        profiler.report(args.profile_top)
+    if args.profile_json is not None:
+        profiler.dump_json(args.profile_json)
+    if args.profile_trace is not None:
+        profiler.dump_chrome_trace(args.profile_trace)
+    
+    if args.watch:
+        try:
+            watch(args, site)
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == "__main__":
     try:
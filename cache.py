@@ -0,0 +1,109 @@
+import os
+import hashlib
+import tempfile
+
+# Default upper bound of the cache directory in MiB
+DEFAULT_CACHE_SIZE = 512
+
+def make_key(*parts):
+    h = hashlib.sha256()
+    
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    
+    return h.hexdigest()
+
+class Cache:
+    """
+    A persistent key-value store in a directory. Every entry
+    is a file named after its key inside the directory of its
+    namespace. Entries are touched when they are read so that
+    evict() can drop the least recently used ones once the
+    directory grows beyond max_size bytes.
+    """
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+    
+    def path(self, namespace, key):
+        return os.path.join(self.directory, namespace, key[:2], key[2:])
+    
+    def get(self, namespace, key):
+        path = self.path(namespace, key)
+        
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        
+        return data
+    
+    def put(self, namespace, key, data):
+        path = self.path(namespace, key)
+        folder = os.path.dirname(path)
+        
+        try:
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+            
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except:
+                os.unlink(tmp)
+                raise
+        except OSError:
+            # A cache that cannot be written is just a cache miss next time
+            pass
+    
+    def evict(self):
+        if self.max_size is None:
+            return
+        
+        entries = []
+        total = 0
+        
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        
+        if total <= self.max_size:
+            return
+        
+        entries.sort()
+        
+        for _, size, path in entries:
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            
+            total -= size
+            
+            if total <= self.max_size:
+                break
+
+def open_cache(config):
+    return Cache(
+        config["cache"]["dir"],
+        config["cache"]["size"] * 1024 * 1024
+    )
@@ -4,6 +4,9 @@ import configparser
 from .errors import BiberException
 from . import routes
 from . import themes
+from . import cache
+from . import utils
+from . import feed as biber_feed
 
 # If the PGP section is used in the config
 # file, the following options MUST be set.
@@ -42,6 +45,7 @@ ENABLED_SOCIALS = {
     "twitter": Social("https://twitter.com/{}", f"{routes.STATIC_FOLDER}img/twitter.png", "Twitter"),
     "email": Social(routes.KEY_FOLDER + "{}.asc", f"{routes.STATIC_FOLDER}img/email.png", "E-Mail"),
     "rss": Social(routes.RSS_FEED, f"{routes.STATIC_FOLDER}img/feed.png", "RSS"),
+    "atom": Social(routes.ATOM_FEED, f"{routes.STATIC_FOLDER}img/feed.png", "Atom"),
 }
 
 class Config:
@@ -61,9 +65,19 @@ class Config:
             "domain" : None,
             "theme" : None,
             "plugins": None,
+            "page-size" : None,
+            "copy-mode" : "copy",
+            "include" : ["*.post"],
+            "exclude" : [],
         }
         self._feed = {
-            "size" : None
+            "size" : None,
+            "format" : "rss",
+            "content" : "summary",
+        }
+        self._cache = {
+            "dir" : None,
+            "size" : cache.DEFAULT_CACHE_SIZE
         }
     
     def has_blog(self):
@@ -93,6 +107,8 @@ class Config:
             return self._pgp
         elif key.lower() == "feed":
             return self._feed
+        elif key.lower() == "cache":
+            return self._cache
         else:
             raise BiberException("No such section in config file: {}", key)
             
@@ -133,6 +149,21 @@ class Config:
                     raise BiberException(f"Invalid theme: {value}")
                     
                 self._blog[option] = THEMES[value]
+            elif option in ["include", "exclude"]:
+                self._blog[option] = [glob.strip() for glob in blog[option].split(",") if glob.strip()]
+            elif option == "copy-mode":
+                if blog[option] not in utils.COPY_MODES:
+                    raise BiberException(f"Invalid copy mode: {blog[option]}")
+                
+                self._blog[option] = blog[option]
+            elif option == "page-size":
+                try:
+                    self._blog[option] = int(blog[option])
+                except ValueError:
+                    raise BiberException(f"Invalid page size: {blog[option]}")
+                
+                if self._blog[option] < 1:
+                    raise BiberException(f"Invalid page size: {blog[option]}")
             else:
                 self._blog[option] = blog[option]
             
@@ -147,8 +178,31 @@ class Config:
                 
             if option == "size":
                 self._feed["size"] = int(feed[option])
+            elif option == "format":
+                if feed[option] not in biber_feed.FEED_FORMATS:
+                    raise BiberException(f"Invalid feed format: {feed[option]}")
+                
+                self._feed[option] = feed[option]
+            elif option == "content":
+                if feed[option] not in biber_feed.FEED_CONTENTS:
+                    raise BiberException(f"Invalid feed content: {feed[option]}")
+                
+                self._feed[option] = feed[option]
             else:
                 self._feed[option] = feed[option]
+                
+    def parse_cache(self, cache):
+        for option in cache:
+            if option not in self._cache:
+                raise BiberException(f"Invalid option in Cache section: '{option}'")
+                
+            if option == "size":
+                try:
+                    self._cache["size"] = int(cache[option])
+                except ValueError:
+                    raise BiberException(f"Invalid cache size: {cache[option]}")
+            else:
+                self._cache[option] = cache[option]
 
 def parse(filename):
     ret = Config()
@@ -171,14 +225,29 @@ def parse(filename):
             ret.parse_blog(config[section])
         elif section.lower() == "feed":
             ret.parse_feed(config[section])
+        elif section.lower() == "cache":
+            ret.parse_cache(config[section])
         else:
             raise BiberException(f"Invalid section name: '{section}'")
             
     if not ret.has_blog():
         raise BiberException(f"The section 'Blog' is required but not set in the configuration file")
     
+    # By default the cache lives next to the config file
+    # and not in the output directory that gets deployed
+    if ret["cache"]["dir"] is None:
+        ret["cache"]["dir"] = os.path.join(
+            os.path.dirname(os.path.abspath(filename)),
+            ".biber-cache"
+        )
+        
     if ret.has_feed():
-        social = ENABLED_SOCIALS["rss"]
+        # Link the RSS feed unless there is only an Atom feed
+        if ret["feed"]["format"] == "atom":
+            social = ENABLED_SOCIALS["atom"]
+        else:
+            social = ENABLED_SOCIALS["rss"]
+        
         social.build_url("")
         ret["socials"].append(social)
         
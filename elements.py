@@ -1,23 +1,49 @@
+# All elements use __slots__ so that nodes carry no
+# per-instance __dict__. The __reduce__ methods keep the
+# pickled form down to the constructor arguments plus the
+# children, which is what gets stored in the cache and
+# sent to worker processes.
+
 class Element:
-    pass
+    __slots__ = ()
 
 class Heading(list, Element):
+    __slots__ = ("level",)
+    
     def __init__(self, level):
         self.level = level
         super().__init__()
-        
+    
+    def __reduce__(self):
+        return (Heading, (self.level,), None, iter(self))
+    
     def __repr__(self):
         return f"Heading(level={self.level}, {super().__repr__()})"
 
 class Paragraph(list, Element):
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (Paragraph, (), None, iter(self))
+    
     def __repr__(self):
         return f"Paragraph({super().__repr__()})"
 
 class Text(str, Element):
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (Text, (str(self),))
+    
     def __repr__(self):
         return f"Text({super().__repr__()})"
 
 class Strong(list, Element):
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (Strong, (), None, iter(self))
+    
     def __repr__(self):
         return f"Strong({super().__repr__()})"
 
@@ -27,85 +53,145 @@ class Block(str, Element):
     but without any info => doesn't contain source
     code.
     """
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (Block, (str(self),))
+    
     def __repr__(self):
         return f"Block({super().__repr__()})"
 
 class ListItem(list, Element):
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (ListItem, (), None, iter(self))
+    
     def __repr__(self):
         return f"ListItem({super().__repr__()})"
 
 class UnorderedList(Element):
+    __slots__ = ("items",)
+    
     def __init__(self):
         self.items = []
-        
+    
     def __repr__(self):
         return f"UnorderedList({self.items})"
-        
+
 class Quote(list, Element):
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (Quote, (), None, iter(self))
+    
     def __repr__(self):
         return f"Quote({super().__repr__()})"
-    
+
 class LineBreak(Element):
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (LineBreak, ())
+    
     def __repr__(self):
         return f"LineBreak()"
-    
+
 class Emphasis(list, Element):
+    __slots__ = ("strength",)
+    
     def __init__(self, strength):
         self.strength = strength
         super().__init__()
-        
+    
+    def __reduce__(self):
+        return (Emphasis, (self.strength,), None, iter(self))
+    
     def __repr__(self):
         return f"Emphasis(strength={self.strength}, {super().__repr__()})"
-        
+
 class Tag(str, Element):
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (Tag, (str(self),))
+    
     def __repr__(self):
         return f"Tag({super().__repr__()})"
-    
+
 class Link(list, Element):
+    __slots__ = ("href",)
+    
     def __init__(self, href):
         self.href = href
         super().__init__()
-        
+    
+    def __reduce__(self):
+        return (Link, (self.href,), None, iter(self))
+    
     def __repr__(self):
         return f"Link(href={self.href}, {super().__repr__()})"
-        
+
 class PluginInvocation(Element):
+    __slots__ = ("name", "args", "content")
+    
     def __init__(self, name, args, content):
         self.name = name
         self.args = args
         self.content = content
-        
+    
+    def __reduce__(self):
+        return (PluginInvocation, (self.name, self.args, self.content))
+    
     def __repr__(self):
         return f"CodeBlock(name={self.name}, args={self.args}, content={self.content})"
-        
+
 class OrderedList(Element):
+    __slots__ = ("items",)
+    
     def __init__(self):
         self.items = []
-        
+    
     def __repr__(self):
         return f"OrderedList({self.items})"
-        
+
 class Image(Element):
+    __slots__ = ("src", "alt")
+    
     def __init__(self, src, alt):
         self.src = src
         self.alt = alt
-        
+    
+    def __reduce__(self):
+        return (Image, (self.src, self.alt))
+    
     def __repr__(self):
         return f"Image(src={self.src}, alt={self.alt})"
 
 class Th(list, Element):
-    pass
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (Th, (), None, iter(self))
 
 class Td(list, Element):
-    pass
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (Td, (), None, iter(self))
 
 class Trow(list, Element):
-    pass
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return (Trow, (), None, iter(self))
 
 class Table(Element):
+    __slots__ = ("head", "body")
+    
     def __init__(self):
         self.head = None
         self.body = []
-        
+    
     def __repr__(self):
         return f"Table(head={self.head}, body={self.body})"
@@ -0,0 +1,219 @@
+import re
+import html
+import datetime
+import urllib.parse
+import email.utils
+from xml.sax.saxutils import escape, quoteattr
+
+from .errors import BiberException
+from . import routes, utils
+
+FEED_FORMATS = ["rss", "atom", "both"]
+
+# Whether the entries only link to the posts or
+# carry the whole rendered body of the post
+FEED_CONTENTS = ["summary", "full"]
+
+# How many bytes XMLWriter collects before
+# it hands them to the file
+XML_BUFFER_SIZE = 1 << 16
+
+ATOM_NAMESPACE = "http://www.w3.org/2005/Atom"
+
+# The feeds only change when their posts change so
+# the dates must not depend on the time of the build
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+class XMLWriter:
+    """
+    Writes XML to a file. Text and attribute values are
+    escaped and the fragments are collected in a buffer
+    that is written out in large chunks.
+    """
+    def __init__(self, f, buffer_size=XML_BUFFER_SIZE):
+        self.f = f
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+    
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+        
+        if self.size >= self.buffer_size:
+            self.flush()
+    
+    def flush(self):
+        self.f.write("".join(self.parts))
+        self.parts.clear()
+        self.size = 0
+    
+    def declaration(self):
+        self.write('<?xml version="1.0" encoding="UTF-8" ?>')
+    
+    # Empty elements are closed right away
+    def start(self, tag, attrs={}, empty=False):
+        self.write(f"<{tag}")
+        
+        for name, value in attrs.items():
+            self.write(f" {name}={quoteattr(value)}")
+        
+        self.write("/>" if empty else ">")
+    
+    def end(self, tag):
+        self.write(f"</{tag}>")
+    
+    def element(self, tag, text=None, attrs={}):
+        if text is None:
+            self.start(tag, attrs, True)
+        else:
+            self.start(tag, attrs)
+            self.write(escape(text))
+            self.end(tag)
+
+LINK_ATTRIBUTE = re.compile(r"""\b(src|href)=(["'])(.*?)\2""")
+
+# Images and links in the bodies are relative to the folder
+# of the post, many feed readers ignore xml:base so they
+# are made absolute
+def absolute_links(body, base):
+    def replace(match):
+        attr, quote, url = match.groups()
+        url = urllib.parse.urljoin(base, html.unescape(url))
+        return f"{attr}={quote}{html.escape(url)}{quote}"
+    
+    return LINK_ATTRIBUTE.sub(replace, body)
+
+def get_feed_routes(config):
+    format = config["feed"]["format"]
+    ret = []
+    
+    if format in ["rss", "both"]:
+        ret.append(routes.RSS_FEED)
+    if format in ["atom", "both"]:
+        ret.append(routes.ATOM_FEED)
+    
+    return ret
+
+def rss_date(date):
+    return email.utils.format_datetime(date.astimezone(datetime.timezone.utc))
+
+def atom_date(date):
+    return date.astimezone(datetime.timezone.utc).isoformat()
+
+# The date of the newest post stands in for the time of the build
+def get_updated(posts):
+    return max((post.metadata.date for post in posts), default=EPOCH)
+
+def write_rss(writer, config, posts, get_body):
+    domain = config["blog"]["domain"]
+    updated = rss_date(get_updated(posts))
+    
+    writer.start("rss", {"version": "2.0"})
+    writer.start("channel")
+    writer.element("title", config["blog"]["title"])
+    writer.element("description", "")
+    writer.element("lastBuildDate", updated)
+    writer.element("link", domain + routes.RSS_FEED)
+    writer.element("pubDate", updated)
+    writer.element("generator", "biber 2.0")
+    
+    for post in posts:
+        url = domain + routes.post_page(post)
+        
+        if get_body is None:
+            # The description is HTML that gets escaped once more
+            description = f'{html.escape(post.metadata.title)}: <a href="{html.escape(url)}">{html.escape(url)}</a>'
+        else:
+            description = absolute_links(get_body(post), domain + routes.post_folder(post))
+        
+        writer.start("item")
+        writer.element("title", post.metadata.title)
+        writer.element("description", description)
+        writer.element("pubDate", rss_date(post.metadata.date))
+        
+        for cat in post.metadata.categories:
+            writer.element("category", cat)
+        
+        writer.element("author", post.metadata.author)
+        writer.element("link", url)
+        writer.element("guid", url, {"isPermaLink": "true"})
+        writer.end("item")
+    
+    writer.end("channel")
+    writer.end("rss")
+
+def write_atom(writer, config, posts, get_body):
+    domain = config["blog"]["domain"]
+    
+    writer.start("feed", {"xmlns": ATOM_NAMESPACE})
+    writer.element("title", config["blog"]["title"])
+    writer.element("id", domain + routes.HOME_PAGE)
+    writer.element("link", None, {"rel": "self", "href": domain + routes.ATOM_FEED})
+    writer.element("link", None, {"href": domain + routes.HOME_PAGE})
+    writer.element("updated", atom_date(get_updated(posts)))
+    writer.element("generator", "biber", {"version": "2.0"})
+    
+    for post in posts:
+        url = domain + routes.post_page(post)
+        
+        writer.start("entry")
+        writer.element("title", post.metadata.title)
+        writer.element("id", url)
+        writer.element("link", None, {"href": url})
+        writer.element("updated", atom_date(post.metadata.date))
+        writer.start("author")
+        writer.element("name", post.metadata.author)
+        writer.end("author")
+        
+        for cat in post.metadata.categories:
+            writer.element("category", None, {"term": cat})
+        
+        if get_body is None:
+            writer.element("summary", post.metadata.title)
+        else:
+            base = domain + routes.post_folder(post)
+            writer.element("content", absolute_links(get_body(post), base), {
+                "type": "html",
+                "xml:base": base,
+            })
+        
+        writer.end("entry")
+    
+    writer.end("feed")
+
+FEED_WRITERS = {
+    routes.RSS_FEED : write_rss,
+    routes.ATOM_FEED : write_atom,
+}
+
+# Writes the feed with the given route into f. get_body(post)
+# returns the rendered HTML of a post, it is only used if the
+# feed carries the full content of the posts.
+def write_feed(f, config, route, posts, get_body=None):
+    if config["blog"]["domain"] is None:
+        raise BiberException("Configuration is set to generate a feed but no domain is given")
+    
+    if config["feed"]["content"] != "full":
+        get_body = None
+    elif get_body is None:
+        raise BiberException("Cannot generate a feed with the full content of the posts without their bodies")
+    
+    writer = XMLWriter(f)
+    writer.declaration()
+    FEED_WRITERS[route](writer, config, list(posts), get_body)
+    writer.flush()
+
+# Feeds whose posts did not change come out the same
+# and utils.create_open() leaves them untouched
+def generate_feed(config, posts, get_body=None):
+    if not config.has_feed():
+        return
+    
+    posts = list(posts)
+    
+    for route in get_feed_routes(config):
+        out_file = utils.join_paths(config["blog"]["out"], route)
+        
+        with utils.create_open(out_file) as f:
+            write_feed(f, config, route, posts, get_body)
@@ -0,0 +1,193 @@
+import os
+import json
+import hashlib
+
+from . import routes, utils, cache
+
+# Bump this whenever the layout of the manifest changes
+# so that old manifests are discarded instead of misread
+MANIFEST_VERSION = 3
+MANIFEST_FILE = "/.biber-manifest"
+
+def digest_files(filenames):
+    h = hashlib.sha256()
+    
+    for filename in filenames:
+        h.update(filename.encode())
+        h.update(b"\0")
+        h.update((utils.hash_file(filename) or "").encode())
+        h.update(b"\0")
+    
+    return h.hexdigest()
+
+def plugin_digest(plugin):
+    # Plugins are either single modules or packages,
+    # in both cases __file__ points to the code
+    return utils.hash_file(plugin.__file__)
+
+# Identifies everything besides the element tree that
+# goes into the rendered body of a post
+def renderer_digest(theme, plugins):
+    parts = [str(theme.RENDERER_VERSION)]
+    
+    for name in sorted(plugins):
+        parts.append(name)
+        parts.append(plugin_digest(plugins[name]) or "")
+    
+    return cache.make_key(*parts)
+
+class Manifest:
+    """
+    Records the inputs that went into every rendered post:
+    the post file itself, its images and attachments and the
+    plugins it invoked. Together with a global digest over
+    the configuration and the theme templates this allows us
+    to only render posts again whose inputs actually changed.
+    Other pages are recorded by a signature of what they
+    show together with a digest of their templates.
+    """
+    def __init__(self, filename, global_digest, plugins, page_digests={}):
+        self.filename = filename
+        self.global_digest = global_digest
+        self.plugins = plugins
+        self.page_digests = page_digests
+        self._old = {}
+        self._new = {}
+        self._old_pages = {}
+        self._new_pages = {}
+        self._plugin_digests = {}
+    
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        
+        if data.get("version") != MANIFEST_VERSION:
+            return
+        
+        self._old_pages = data.get("pages", {})
+        
+        if data.get("global") != self.global_digest:
+            return
+        
+        self._old = data.get("posts", {})
+    
+    def save(self):
+        data = {
+            "version": MANIFEST_VERSION,
+            "global": self.global_digest,
+            "posts": self._new,
+            "pages": self._new_pages,
+        }
+        
+        # json.dumps() uses the C encoder, json.dump() and
+        # indentation fall back to the much slower Python one
+        with utils.create_open(self.filename) as f:
+            f.write(json.dumps(data, sort_keys=True, separators=(",", ":")))
+    
+    def get_plugin_digest(self, name):
+        if name not in self._plugin_digests:
+            if name in self.plugins:
+                self._plugin_digests[name] = plugin_digest(self.plugins[name])
+            else:
+                self._plugin_digests[name] = None
+        
+        return self._plugin_digests[name]
+    
+    def is_dirty(self, post, out_dir):
+        entry = self._old.get(post.filename)
+        
+        if entry is None or entry["id"] != post.id:
+            return True
+        
+        if not os.path.isfile(utils.join_paths(out_dir, routes.post_page(post))):
+            return True
+        
+        stats = entry["stats"]
+        
+        for filename, digest in entry["files"].items():
+            signature = utils.file_signature(filename)
+            
+            # Files that were not touched since need not be read
+            if signature is not None and signature == stats.get(filename):
+                continue
+            if utils.hash_file(filename) != digest:
+                return True
+            
+            stats[filename] = signature
+        
+        for name, digest in entry["plugins"].items():
+            if self.get_plugin_digest(name) != digest:
+                return True
+        
+        # Nothing changed, carry the old entry over
+        self._new[post.filename] = entry
+        return False
+    
+    def is_page_dirty(self, route, kind, signature, out_dir):
+        signature = cache.make_key(self.page_digests.get(kind, ""), signature)
+        
+        # Watch mode checks pages repeatedly, compare with the latest signature
+        old = self._new_pages.get(route, self._old_pages.get(route))
+        self._new_pages[route] = signature
+        
+        if not os.path.isfile(utils.join_paths(out_dir, route)):
+            return True
+        
+        return old != signature
+    
+    def get_files(self, post):
+        entry = self._new.get(post.filename)
+        
+        if entry is None:
+            return []
+        
+        return list(entry["files"])
+    
+    # The plugins that the posts of this build invoked
+    def get_used_plugins(self):
+        ret = set()
+        
+        for entry in self._new.values():
+            ret.update(entry["plugins"])
+        
+        return ret
+    
+    def update(self, post, images, plugins):
+        post_dir = os.path.dirname(post.filename)
+        files = [post.filename]
+        files.extend(utils.join_paths(post_dir, img) for img in images)
+        files.extend(utils.join_paths(post_dir, att) for att in post.metadata.attachment)
+        
+        self._new[post.filename] = {
+            "id": post.id,
+            "files": { filename : utils.hash_file(filename) for filename in files },
+            "stats": { filename : utils.file_signature(filename) for filename in files },
+            "plugins": { name : self.get_plugin_digest(name) for name in plugins },
+        }
+
+# The global digest and the digests of the other pages,
+# they have to be computed again when a template changes
+def get_digests(config, config_file):
+    theme = config["blog"]["theme"]
+    
+    # Only the templates of the post pages matter here
+    global_files = [config_file] + theme.get_template_files("post")
+    page_digests = {
+        kind : digest_files([config_file] + theme.get_template_files(kind))
+        for kind in set(theme.TEMPLATE_PAGES.values()) if kind != "post"
+    }
+    return digest_files(global_files), page_digests
+
+def load(config, config_file, plugins):
+    global_digest, page_digests = get_digests(config, config_file)
+    ret = Manifest(
+        utils.join_paths(config["blog"]["out"], MANIFEST_FILE),
+        global_digest,
+        plugins,
+        page_digests
+    )
+    ret.load()
+    return ret
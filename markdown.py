@@ -1,67 +1,31 @@
 from . import elements
 from . import utils
+from . import cache
+from .errors import ParsingException
 
+import pickle
+import threading
 import markdown_it
 
-def parse_heading(token, stream):
-    levels = {
-        "h1": 1,
-        "h2": 2,
-        "h3": 3,
-        "h4": 4,
-        "h5": 4,
-        "h6": 4
-    }
-    
-    if token.tag not in levels:
+# Bump this whenever the element tree produced
+# for a given markdown text changes, it
+# invalidates all cached trees
+PARSER_VERSION = 2
+
+HEADING_LEVELS = {
+    "h1": 1,
+    "h2": 2,
+    "h3": 3,
+    "h4": 4,
+    "h5": 4,
+    "h6": 4
+}
+
+def new_heading(token):
+    if token.tag not in HEADING_LEVELS:
         raise ParsingException(f"Invalid heading type '{token.tag}'")
-        
-    element = elements.Heading(levels[token.tag])
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed heading")
-            
-        if token.type == "heading_close":
-            break
-        else:
-            element.extend(parse_any(token, stream))
-    
-    return element
-    
-def parse_strong(token, stream):
-    element = elements.Strong()
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed strong")
-            
-        if token.type == "strong_close":
-            break
-        else:
-            element.extend(parse_any(token, stream))
-    
-    return element
     
-def parse_paragraph(token, stream):
-    element = elements.Paragraph()
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed paragraph")
-        
-        if token.type == "paragraph_close":
-            break
-        else:
-            element.extend(parse_any(token, stream))
-    
-    return element
+    return elements.Heading(HEADING_LEVELS[token.tag])
     
 def parse_argstring(argstring):
     ret = {}
@@ -77,7 +41,7 @@ def parse_argstring(argstring):
         
     return ret
     
-def parse_codeblock(token, stream):
+def parse_codeblock(token):
     if not token.info:
         return elements.Block(token.content)
     else:
@@ -86,280 +50,230 @@ def parse_codeblock(token, stream):
         if argstring:
             args = parse_argstring(argstring[0])
         return elements.PluginInvocation(name, args, token.content)
-
-def parse_list_item(token, stream):
-    element = elements.ListItem()
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed list item")
-        
-        if token.type == "list_item_close":
-            break
-        else:
-            element.extend(parse_any(token, stream))
-    
-    return element
-
-def parse_list(token, stream):
-    element = None
-    
-    if token.type == "bullet_list_open":
-        element = elements.UnorderedList()
-    elif token.type == "ordered_list_open":
-        element = elements.OrderedList()
-    else:
-        raise ParsingException(f"Invalid list type: {token.type}")
-        
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed list")
-            
-        if token.type == "bullet_list_close" or token.type == "ordered_list_close":
-            break
-        else:
-            element.items.append(parse_list_item(token, stream))
-            
-    return element
-    
-def parse_blockquote(token, stream):
-    element = elements.Quote()
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed blockquote")
-            
-        if token.type == "blockquote_close":
-            break
-        else:
-            element.extend(parse_any(token, stream))
-    
-    return element
-    
-def parse_linebreak(token, stream):
-    return elements.LineBreak()
-
-def parse_emphasis(token, stream):
-    element = elements.Emphasis(len(token.markup))
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed emphasis")
-            
-        if token.type == "em_close":
-            break
-        else:
-            element.extend(parse_any(token, stream))
-            
-    return element
-    
-def parse_tag(token, stream):
-    return elements.Tag(token.content)
-    
-def parse_link(token, stream):
-    element = elements.Link(token.attrs["href"])
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed link")
-            
-        if token.type == "link_close":
-            break
-        else:
-            element.extend(parse_any(token, stream))
-    
-    return element
-    
-def parse_image(token, stream):
-    alt = []
     
+def parse_image(token):
     if "alt" not in token.attrs or token.children:
-        substream = iter(token.children)
-        for child in substream:
-            alt.extend(parse_any(child, substream))
+        # The alt text is a (tiny) inline document of its own
+        alt = build_tree(token.children)
     else:
-        alt.append(elements.Text(token.attrs["alt"]))
+        alt = [elements.Text(token.attrs["alt"])]
     
     return elements.Image(token.attrs["src"], alt)
 
-def parse_th(token, stream):
-    element = elements.Th()
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed th")
-            
-        if token.type == "th_close":
-            break
-        else:
-            element.extend(parse_any(token, stream))
-    
-    return element
+# What kind of children a container accepts
+CHILDREN_ANY = "any"
+CHILDREN_LIST_ITEMS = "list items"
+CHILDREN_TABLE_PARTS = "table parts"
+CHILDREN_ROWS = "rows"
+CHILDREN_CELLS = "cells"
 
-def parse_td(token, stream):
-    element = elements.Td()
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed td")
-            
-        if token.type == "td_close":
-            break
-        else:
-            element.extend(parse_any(token, stream))
-    
-    return element
+# Tokens that open a container element:
+# open token => (close token, name, children, constructor)
+CONTAINERS = {
+    "heading_open" : ("heading_close", "heading", CHILDREN_ANY, new_heading),
+    "paragraph_open" : ("paragraph_close", "paragraph", CHILDREN_ANY, lambda x: elements.Paragraph()),
+    "strong_open" : ("strong_close", "strong", CHILDREN_ANY, lambda x: elements.Strong()),
+    "em_open" : ("em_close", "emphasis", CHILDREN_ANY, lambda x: elements.Emphasis(len(x.markup))),
+    "link_open" : ("link_close", "link", CHILDREN_ANY, lambda x: elements.Link(x.attrs["href"])),
+    "blockquote_open" : ("blockquote_close", "blockquote", CHILDREN_ANY, lambda x: elements.Quote()),
+    "bullet_list_open" : ("bullet_list_close", "list", CHILDREN_LIST_ITEMS, lambda x: elements.UnorderedList()),
+    "ordered_list_open" : ("ordered_list_close", "list", CHILDREN_LIST_ITEMS, lambda x: elements.OrderedList()),
+    "list_item_open" : ("list_item_close", "list item", CHILDREN_ANY, lambda x: elements.ListItem()),
+    "table_open" : ("table_close", "table", CHILDREN_TABLE_PARTS, lambda x: elements.Table()),
+    "thead_open" : ("thead_close", "thead", CHILDREN_ROWS, lambda x: []),
+    "tbody_open" : ("tbody_close", "tbody", CHILDREN_ROWS, lambda x: []),
+    "tr_open" : ("tr_close", "tr", CHILDREN_CELLS, lambda x: elements.Trow()),
+    "th_open" : ("th_close", "th", CHILDREN_ANY, lambda x: elements.Th()),
+    "td_open" : ("td_close", "td", CHILDREN_ANY, lambda x: elements.Td()),
+}
+# Tokens that make up an element on their own
+LEAVES = {
+    "code_block" : parse_codeblock,
+    "fence": parse_codeblock,
+    "softbreak": lambda x: elements.LineBreak(),
+    "hardbreak": lambda x: elements.LineBreak(),
+    "text": lambda x: elements.Text(x.content),
+    "code_inline": lambda x: elements.Tag(x.content),
+    "image": parse_image,
+}
+IGNORED_ITEMS = {
+    "hr",
+    "html_block",
+    "html_inline"
+}
+ALLOWED_CHILDREN = {
+    CHILDREN_ANY : IGNORED_ITEMS | LEAVES.keys() | {
+        "heading_open",
+        "paragraph_open",
+        "strong_open",
+        "em_open",
+        "link_open",
+        "blockquote_open",
+        "bullet_list_open",
+        "ordered_list_open",
+        "table_open",
+    },
+    CHILDREN_LIST_ITEMS : {"list_item_open"},
+    CHILDREN_TABLE_PARTS : {"thead_open", "tbody_open"},
+    CHILDREN_ROWS : {"tr_open"},
+    CHILDREN_CELLS : {"th_open", "td_open"},
+}
 
-def parse_tr(token, stream):
-    element = elements.Trow()
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed tr")
+def add_child(parent, children, child, child_type):
+    if children == CHILDREN_LIST_ITEMS:
+        parent.items.append(child)
+    elif children == CHILDREN_TABLE_PARTS:
+        if child_type == "thead_open":
+            if len(child) > 1:
+                raise ParsingException(f"Got more than one row in thead")
             
-        if token.type == "tr_close":
-            break
-        elif token.type == "th_open":
-            element.append(parse_th(token, stream))
-        elif token.type == "td_open":
-            element.append(parse_td(token, stream))
+            parent.head = child[0] if child else None
         else:
-            raise ParsingException(f"Unexpected markdown element in tr: {token.type}")
-    
-    return element
+            parent.body = child
+    else:
+        parent.append(child)
 
-def parse_thead(token, stream):
-    ret = None
+def build_tree(tokens):
+    """
+    Turns the token list of markdown-it into a list of
+    elements in a single pass. Instead of recursing for
+    every container it keeps the open containers on an
+    explicit stack, so arbitrarily deep nesting costs
+    neither Python stack frames nor generator layers.
+    """
+    ret = []
+    stack = []
     
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed thead")
-            
-        if token.type == "thead_close":
-            break
-        elif token.type == "tr_open":
-            if ret is not None:
-                raise ParsingException(f"Got more than one row in thead")
-                
-            ret = parse_tr(token, stream)
-        else:
-            raise ParsingException(f"Unexpected markdown element in thead: {token.type}")
+    # Inline tokens only group the tokens of a line,
+    # splice their children into one flat list
+    flat = []
     
-    return ret
+    for token in tokens:
+        if token.type == "inline":
+            flat.extend(token.children)
+        else:
+            flat.append(token)
     
-def parse_tbody(token, stream):
-    ret = []
+    # The innermost open container
+    node = ret
+    close = None
+    name = None
+    children = CHILDREN_ANY
+    opened = None
+    allowed = ALLOWED_CHILDREN[CHILDREN_ANY]
     
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed tbody")
+    for token in flat:
+        if token.hidden:
+            continue
+        
+        type = token.type
+        
+        if type == "text" and children is CHILDREN_ANY:
+            node.append(elements.Text(token.content))
+        elif type == close:
+            child = node
+            child_type = opened
+            node, close, name, children, opened = stack.pop()
+            allowed = ALLOWED_CHILDREN[children]
             
-        if token.type == "tbody_close":
-            break
-        elif token.type == "tr_open":
-            ret.append(parse_tr(token, stream))
-        else:
-            raise ParsingException(f"Unexpected markdown element in tbody: {token.type}")
+            if children is CHILDREN_ANY:
+                node.append(child)
+            else:
+                add_child(node, children, child, child_type)
+        elif type not in allowed:
+            if children is CHILDREN_ANY:
+                raise ParsingException(f"Unknown markdown element: {type}")
+            
+            raise ParsingException(f"Unexpected markdown element in {name}: {type}")
+        elif type in CONTAINERS:
+            stack.append((node, close, name, children, opened))
+            close, name, children, constructor = CONTAINERS[type]
+            node = constructor(token)
+            opened = type
+            allowed = ALLOWED_CHILDREN[children]
+        elif type in LEAVES:
+            add_child(node, children, LEAVES[type](token), type)
+    
+    if stack:
+        raise ParsingException(f"Unclosed {name}")
     
     return ret
 
-def parse_table(token, stream):
-    element = elements.Table()
-    
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            raise ParsingException(f"Unclosed table")
+# Default options of the parser used for posts
+PARSER_TYPOGRAPHER = True
+PARSER_RULES = ("replacements", "smartquotes", "table")
+
+# A document that touches the block, inline and core
+# rule chains so that they get compiled on creation
+WARMUP_DOCUMENT = "*warm* up\n\n| a |\n|---|\n| b |\n"
+
+parsers = {}
+parsers_lock = threading.Lock()
+
+def get_parser(typographer=PARSER_TYPOGRAPHER, rules=PARSER_RULES):
+    """
+    Returns a configured MarkdownIt instance that is shared
+    by everyone asking for the same options. The instance
+    is fully set up before it is handed out, so concurrent
+    calls to parse() on it are safe.
+    """
+    key = (typographer, tuple(rules))
+    md = parsers.get(key)
+    
+    if md is None:
+        with parsers_lock:
+            md = parsers.get(key)
             
-        if token.type == "table_close":
-            break
-        elif token.type == "thead_open":
-            element.head = parse_thead(token, stream)
-        elif token.type == "tbody_open":
-            element.body = parse_tbody(token, stream)
-        else:
-            raise ParsingException(f"Unexpected markdown element in table: {token.type}")
-    
-    return element
+            if md is None:
+                md = markdown_it.MarkdownIt("commonmark", {
+                    "typographer": typographer
+                })
+                md.enable(list(rules))
+                # markdown-it compiles its rule chains lazily
+                md.parse(WARMUP_DOCUMENT)
+                parsers[key] = md
+    
+    return md
 
-ANY_ITEMS = {
-    "heading_open" : parse_heading,
-    "paragraph_open" : parse_paragraph,
-    "code_block" : parse_codeblock,
-    "fence": parse_codeblock,
-    "bullet_list_open" : parse_list,
-    "ordered_list_open" : parse_list,
-    "blockquote_open" : parse_blockquote,
-    "softbreak": parse_linebreak,
-    "hardbreak": parse_linebreak,
-    "text": lambda x,_: elements.Text(x.content),
-    "strong_open": parse_strong,
-    "em_open": parse_emphasis,
-    "code_inline": parse_tag,
-    "link_open": parse_link,
-    "image": parse_image,
-    "table_open" : parse_table,
-}
-IGNORED_ITEMS = [
-    "hr",
-    "html_block",
-    "html_inline"
-]
-def parse_any(token, stream):
-    if token.type in IGNORED_ITEMS:
-        return []
-    elif token.type not in ANY_ITEMS:
-        print(token)
-        raise ParsingException(f"Unknown markdown element: {token.type}")
+def parse_markdown(content, parser=None):
+    if parser is None:
+        parser = get_parser()
     
-    return [ ANY_ITEMS[token.type](token, stream) ]
+    return build_tree(parser.parse(content))
 
-def token_stream(tokens):
-    # DEBUG:
-    #def get_types(it):
-    #    return list(map(lambda x: x.type if x.type != "inline" else get_types(x.children), it))
-    #print(get_types(tokens))
+def parse_many(contents, parser=None):
+    if parser is None:
+        parser = get_parser()
     
-    for token in tokens:
-        if token.hidden:
-            continue
-            
-        if token.type == "inline":
-            for child in token_stream(token.children):
-                yield child
-        else:
-            yield token
+    return [ parse_markdown(content, parser) for content in contents ]
 
-def parse_markdown(content):
-    ret = []
-    md = markdown_it.MarkdownIt("commonmark", {
-        "typographer": True
-    })
-    md.enable(["replacements", "smartquotes", "table"])
-    stream = iter(token_stream(md.parse(content)))
-    
-    for token in stream:
-        ret.extend(parse_any(token, stream))
+def tree_key(content, typographer=PARSER_TYPOGRAPHER, rules=PARSER_RULES):
+    return cache.make_key(
+        str(PARSER_VERSION),
+        markdown_it.__version__,
+        repr((typographer, tuple(rules))),
+        content
+    )
+
+def parse_markdown_cached(content, tree_cache, refresh=False):
+    key = tree_key(content)
+    data = None if refresh else tree_cache.get("trees", key)
     
-    return ret
+    if data is not None:
+        try:
+            return pickle.loads(data)
+        except Exception:
+            # Corrupt or stale entry, parse again and overwrite it
+            pass
+    
+    tree = parse_markdown(content)
+    
+    # pickle recurses into the tree, a deeply nested one
+    # simply isn't cached
+    try:
+        data = pickle.dumps(tree, protocol=pickle.HIGHEST_PROTOCOL)
+    except (RecursionError, pickle.PicklingError):
+        return tree
+    
+    tree_cache.put("trees", key, data)
+    return tree
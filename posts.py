@@ -1,9 +1,14 @@
 import os
+import json
+import mmap
+import pickle
+import contextlib
+import fnmatch
 import datetime
+import tempfile
 
 from .errors import BiberException
-from . import routes
-from . import utils
+from . import utils, cache
 
 REQUIRED_METADATA = [
     "author",
@@ -16,6 +21,18 @@ ENABLED_METADATA = REQUIRED_METADATA + [
     "attachment"
 ]
 
+# Remembers the id of every post. It lives in the input
+# directory next to the posts because losing it changes URLs.
+ID_INDEX_FILE = ".biber-ids"
+ID_INDEX_VERSION = 1
+
+# Bump this whenever Metadata or the parsing of the
+# headers changes, it invalidates the listing index
+LISTING_INDEX_VERSION = 4
+
+# Post files of at least this size are read with mmap
+MMAP_THRESHOLD = 1 << 16
+
 class Metadata:
     def __init__(self, author, date, categories, title, sign=[], attachment=[]):
         self.author = author
@@ -24,7 +41,10 @@ class Metadata:
         self.title = title
         self.sign = sign
         self.attachment = attachment
-        
+    
+    def __eq__(self, other):
+        return isinstance(other, Metadata) and vars(self) == vars(other)
+    
     def format_date(self):
         return self.date.strftime("%d %b. %Y")
 
@@ -45,103 +65,333 @@ class Post:
         self.metadata = None
         
     def parse_metadata(self):
+        with map_file(self.filename) as buffer:
+            self.parse_header(buffer)
+    
+    # Only the header is needed for the listing, the body is
+    # read again in get_markdown() if the post gets rendered
+    def parse_header(self, buffer):
         data = {}
         lineno = 1
+        pos = 0
         
-        with open(self.filename) as f:
-            while True:
-                line = f.readline().strip()
-                
-                if not line:
-                    self.start_pos = f.tell()
-                    break
-                
-                if ":" not in line:
-                    raise BiberException(f"Invalid metadata line in post file {self.filename} line {lineno}")
-                    
-                key, value = line.split(":", 1)
-                
-                if key not in ENABLED_METADATA:
-                    raise BiberException(f"Unknown metadata keyword '{key}' in post {self.filename}")
-                elif key in data:
-                    raise BiberException(f"Metadata keyword '{key}' specified twice in {self.filename}")
-                
-                value = value.strip()
+        while True:
+            end = buffer.find(b"\n", pos)
+            
+            if end < 0:
+                end = len(buffer)
+            
+            try:
+                line = buffer[pos:end].decode("utf-8").strip()
+            except UnicodeDecodeError:
+                raise BiberException(f"Invalid UTF-8 in post file {self.filename} line {lineno}")
+            
+            pos = min(end + 1, len(buffer))
+            
+            if not line:
+                self.start_pos = pos
+                break
+            
+            if ":" not in line:
+                raise BiberException(f"Invalid metadata line in post file {self.filename} line {lineno}")
+            
+            key, value = line.split(":", 1)
+            
+            if key not in ENABLED_METADATA:
+                raise BiberException(f"Unknown metadata keyword '{key}' in post {self.filename}")
+            elif key in data:
+                raise BiberException(f"Metadata keyword '{key}' specified twice in {self.filename}")
+            
+            value = value.strip()
+            
+            if key == "date":
+                if value.count(".") != 2:
+                    raise BiberException(f"Invalid date in {self.filename}")
                 
-                if key == "date":
-                    if value.count(".") != 2:
-                        raise BiberException(f"Invalid date in {self.filename}")
-                    
-                    day, month, year = value.split(".")
-                    
-                    try:
-                        day = int(day)
-                        month = int(month)
-                        year = int(year)
-                    except ValueError:
-                        raise BiberException(f"Invalid date in {self.filename}")
-                    
-                    data[key] = datetime.datetime(year, month, day, tzinfo=datetime.timezone.utc)
-                elif key == "categories":
-                    cats = metadata_parse_list(value)
-                    data[key] = list(map(str.upper, cats))
-                elif key in ["sign", "attachment"]:
-                    data[key] = metadata_parse_list(value)
-                else:
-                    data[key] = value
-                    
-                lineno += 1
+                day, month, year = value.split(".")
                 
+                # Also catches dates like 32.1.2020
+                try:
+                    data[key] = datetime.datetime(int(year), int(month), int(day), tzinfo=datetime.timezone.utc)
+                except ValueError:
+                    raise BiberException(f"Invalid date in {self.filename}")
+            elif key == "categories":
+                cats = metadata_parse_list(value)
+                data[key] = list(map(str.upper, cats))
+            elif key in ["sign", "attachment"]:
+                data[key] = metadata_parse_list(value)
+            else:
+                data[key] = value
+            
+            lineno += 1
+        
         for req in REQUIRED_METADATA:
             if req not in data:
                 raise BiberException(f"Metadata missing in {self.filename}: {req}")
-                    
-        self.metadata = Metadata(**data)
         
+        self.metadata = Metadata(**data)
+    
     def get_markdown(self):
         if self.start_pos is None:
             raise BiberException(f"Trying to read markdown content from post before reading the metadata")
         
-        with open(self.filename) as f:
-            f.seek(self.start_pos)
-            return f.read()
+        try:
+            with map_file(self.filename) as buffer, memoryview(buffer) as view, view[self.start_pos:] as body:
+                content = str(body, "utf-8")
+        except UnicodeDecodeError as e:
+            raise BiberException(f"Invalid UTF-8 in post file {self.filename}: {e}")
+        
+        # Same newlines as reading the file in text mode
+        if "\r" in content:
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+        
+        return content
+
+# Reads the whole file at once, large files are mapped into
+# memory instead so that the body is never copied before
+# it is decoded. The mapping is closed when the with block
+# ends so that no file descriptors pile up.
+@contextlib.contextmanager
+def map_file(filename):
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+            yield f.read()
+            return
+        
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
         
-def get_post_files(dirname):
-    for entry in os.listdir(dirname):
-        entry = os.path.join(dirname, entry)
+# Like in .gitignore a glob that ends with / only matches directories
+def matches(path, globs, is_dir=False):
+    for glob in globs:
+        if glob.endswith("/"):
+            if is_dir and fnmatch.fnmatchcase(path, glob.rstrip("/")):
+                return True
+        elif fnmatch.fnmatchcase(path, glob):
+            return True
+    
+    return False
+
+# Whether a file below the input directory is a post according
+# to the include and exclude globs, which are matched against
+# paths relative to the input directory with / as separator.
+# Nothing below an excluded directory is a post.
+def is_post_file(config, filename):
+    rel = os.path.relpath(filename, config["blog"]["in"]).replace(os.sep, "/")
+    
+    if rel.startswith("../"):
+        return False
+    
+    parts = rel.split("/")
+    
+    for i in range(1, len(parts) + 1):
+        if matches("/".join(parts[:i]), config["blog"]["exclude"], i < len(parts)):
+            return False
+    
+    return matches(rel, config["blog"]["include"])
+
+# Yields the filename and the stat result of every post below
+# dirname. dirs maps the directories seen in the last scan to
+# their mtime and the posts and subdirectories they contained.
+# A directory whose mtime did not change still has the same
+# entries so it is not listed again. The entries of this scan
+# are stored in new_dirs.
+def get_post_files(config, dirname, rel, dirs, new_dirs):
+    mtime = os.stat(dirname).st_mtime_ns
+    cached = dirs.get(rel)
+    
+    if cached is not None and cached[0] == mtime:
+        _, files, subdirs = cached
+    else:
+        files = []
+        subdirs = []
         
-        if os.path.isdir(entry):
-            for file in get_post_files(entry):
-                yield file
-        elif entry.endswith(".post"):
-            yield entry
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+                
+                is_dir = entry.is_dir()
+                
+                if matches(entry_rel, config["blog"]["exclude"], is_dir):
+                    continue
+                
+                if is_dir:
+                    subdirs.append(entry.name)
+                elif matches(entry_rel, config["blog"]["include"]):
+                    files.append(entry.name)
+    
+    new_dirs[rel] = (mtime, files, subdirs)
+    
+    for name in files:
+        filename = os.path.join(dirname, name)
         
-def create_post_listing(config, force=False):
+        try:
+            yield filename, os.stat(filename)
+        except FileNotFoundError:
+            continue
+    
+    for name in subdirs:
+        yield from get_post_files(
+            config,
+            os.path.join(dirname, name),
+            f"{rel}/{name}" if rel else name,
+            dirs,
+            new_dirs
+        )
+
+# The listing index holds the directories of the last scan
+# and maps every post file to the stat signature it had when
+# it was parsed, its metadata and the offset of the body. It
+# is stored in the cache so that neither unchanged directories
+# nor the headers of unchanged posts are read again.
+def listing_index_key(config):
+    return cache.make_key(
+        "listing",
+        str(LISTING_INDEX_VERSION),
+        os.path.abspath(config["blog"]["in"]),
+        "\0".join(config["blog"]["include"]),
+        "\0".join(config["blog"]["exclude"])
+    )
+
+def load_listing_index(store, key):
+    data = store.get("listing", key)
+    
+    if data is not None:
+        try:
+            return pickle.loads(data)
+        except Exception:
+            pass
+    
+    return {"dirs": {}, "posts": {}}
+
+def create_post_listing(config):
+    store = cache.open_cache(config)
+    key = listing_index_key(config)
+    index = load_listing_index(store, key)
+    new_index = {"dirs": {}, "posts": {}}
     ret = []
     
-    for post_file in get_post_files(config["blog"]["in"]):
+    for post_file, st in get_post_files(config, config["blog"]["in"], "", index["dirs"], new_index["dirs"]):
         post = Post(post_file)
-        post.parse_metadata()
+        signature = utils.stat_signature(st)
+        entry = index["posts"].get(post_file)
+        
+        if entry is not None and entry[0] == signature:
+            post.metadata = entry[1]
+            post.start_pos = entry[2]
+        else:
+            post.parse_metadata()
+        
+        new_index["posts"][post_file] = (signature, post.metadata, post.start_pos)
         ret.append(post)
     
-    ret.sort(key=lambda x: x.metadata.date)
+    if new_index != index:
+        store.put("listing", key, pickle.dumps(new_index, protocol=pickle.HIGHEST_PROTOCOL))
+    
+    sort_posts(ret)
+    assign_ids(config, ret)
+    return ret
+
+def sort_posts(posts):
+    posts.sort(key=lambda x: x.metadata.date)
+
+def load_id_index(filename):
+    try:
+        with open(filename) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {"version": ID_INDEX_VERSION, "next": 1, "posts": {}}
+    except (OSError, ValueError) as e:
+        raise BiberException(f"Cannot read the post ids from {filename}: {e}")
     
-    for i in range(len(ret)):
-        ret[i].id = i + 1
+    if data.get("version") != ID_INDEX_VERSION:
+        raise BiberException(f"Unsupported version of the post ids in {filename}")
     
-    # Don't render posts again that have not changed
-    if not force:
-        i = 0
-        while i < len(ret):
-            out_file = utils.join_paths(config["blog"]["out"], routes.post_page(ret[i]))
+    return data
 
-            try:
-                if os.path.getmtime(ret[i].filename) < os.path.getmtime(out_file):
-                    del ret[i]
-                    continue
-            except OSError:
-                pass
+# Give every post the id it had before and number new posts
+# by date, continuing after the highest id ever handed out.
+# Ids of deleted posts are never reused so that their old
+# URLs don't suddenly show a different post, and they are
+# kept so that a post that comes back gets its old id again.
+# Posts must be sorted already.
+def assign_ids(config, posts):
+    filename = os.path.join(config["blog"]["in"], ID_INDEX_FILE)
+    index = load_id_index(filename)
+    changed = False
+    
+    for post in posts:
+        key = os.path.relpath(post.filename, config["blog"]["in"]).replace(os.sep, "/")
+        
+        if key in index["posts"]:
+            post.id = index["posts"][key]
+        else:
+            post.id = index["next"]
+            index["posts"][key] = post.id
+            index["next"] += 1
+            changed = True
+    
+    if changed:
+        # A truncated index would lose the ids, replace it atomically
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix=".tmp-")
+        
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f, indent=1, sort_keys=True)
             
-            i += 1
+            os.chmod(tmp, 0o666 & ~utils.UMASK)
+            os.replace(tmp, filename)
+        except:
+            os.unlink(tmp)
+            raise
+
+# Splits the posts into pages of page_size posts. Counting
+# from the oldest post keeps the page boundaries where they
+# are when new posts come in, only the newest page changes.
+def paginate(posts, page_size=None):
+    if page_size is None or len(posts) <= page_size:
+        return [posts]
     
-    return ret
+    return [posts[i:i + page_size] for i in range(0, len(posts), page_size)]
+
+# Changes whenever a post enters or leaves the listing,
+# the metadata of one of its posts changes or one
+# of the additional parts changes
+def listing_signature(posts, *parts):
+    parts = list(parts)
+    
+    for post in posts:
+        parts.append(str(post.id))
+        parts.append(json.dumps(vars(post.metadata), default=str, sort_keys=True))
+    
+    return cache.make_key(*parts)
+
+class CategoryIndex:
+    """
+    Maps every category to its posts in the order of the
+    post listing. It is built in one pass over the posts
+    and shared by all pages that list categories.
+    Categories are keyed in lower case like in the routes.
+    """
+    def __init__(self, posts):
+        self.posts = {}
+        self.hits = {}
+        
+        for post in posts:
+            for cat in post.metadata.categories:
+                cat = cat.lower()
+                selected = self.posts.setdefault(cat, [])
+                
+                if not selected or selected[-1] is not post:
+                    selected.append(post)
+                
+                self.hits[cat] = self.hits.get(cat, 0) + 1
+    
+    def __iter__(self):
+        return iter(self.posts)
+    
+    def __contains__(self, cat):
+        return cat.lower() in self.posts
+    
+    def __getitem__(self, cat):
+        return self.posts[cat.lower()]
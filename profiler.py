@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import contextlib
+
+from . import utils
+
+def format_size(size):
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+def take_io_snapshot():
+    return dict(utils.io_stats)
+
+def io_difference(before, after):
+    return { key : after[key] - before[key] for key in after }
+
+class Stage:
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.duration = 0.0
+        self.io = { key : 0 for key in utils.io_stats }
+
+class PostTiming:
+    """
+    How long the individual steps of rendering one post took.
+    Timestamps come from time.perf_counter() which uses a
+    system-wide monotonic clock on the platforms we care
+    about, so timings taken in worker processes line up
+    with the stages of the main process.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+        self.parse = 0.0
+        self.render = 0.0
+        self.write = 0.0
+        self.io = take_io_snapshot()
+    
+    def finish(self):
+        self.io = io_difference(self.io, take_io_snapshot())
+    
+    def total(self):
+        return self.parse + self.render + self.write
+
+class Profiler:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stages = []
+        self.posts = []
+        self._current = None
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        stage = Stage(name, time.perf_counter())
+        before = take_io_snapshot()
+        self._current = stage
+        
+        try:
+            yield stage
+        finally:
+            stage.duration = time.perf_counter() - stage.start
+            after = io_difference(before, take_io_snapshot())
+            
+            for key, value in after.items():
+                stage.io[key] += value
+            
+            self._current = None
+            self.stages.append(stage)
+    
+    def record_post(self, timing):
+        self.posts.append(timing)
+        
+        # Output of worker processes does not show up in
+        # our own counters, account for it in the stage
+        if self._current is not None and timing.pid != os.getpid():
+            for key, value in timing.io.items():
+                self._current.io[key] += value
+    
+    # All output of all stages including that of worker processes
+    def io_total(self):
+        ret = { key : 0 for key in utils.io_stats }
+        
+        for stage in self.stages:
+            for key, value in stage.io.items():
+                ret[key] += value
+        
+        return ret
+    
+    def report(self, top=10, file=sys.stderr):
+        total = sum(stage.duration for stage in self.stages)
+        
+        print(f"{'Stage':<20} {'Time':>9} {'%':>6} {'Written':>20} {'Copied':>20} {'Skipped':>8}", file=file)
+        
+        for stage in self.stages:
+            share = 100 * stage.duration / total if total else 0
+            written = f"{stage.io['files_written']} / {format_size(stage.io['bytes_written'])}"
+            copied = f"{stage.io['files_copied']} / {format_size(stage.io['bytes_copied'])}"
+            print(f"{stage.name:<20} {stage.duration:>8.3f}s {share:>5.1f}% {written:>20} {copied:>20} {stage.io['files_skipped']:>8}", file=file)
+        
+        print(f"{'total':<20} {total:>8.3f}s", file=file)
+        
+        if not self.posts:
+            return
+        
+        print(file=file)
+        print(f"{min(top, len(self.posts))} slowest of {len(self.posts)} rendered posts:", file=file)
+        
+        for timing in sorted(self.posts, key=lambda x: x.total(), reverse=True)[:top]:
+            print(f"{timing.total():>8.3f}s  parse {timing.parse:.3f}s  render {timing.render:.3f}s  write {timing.write:.3f}s  {timing.filename}", file=file)
+    
+    def to_json(self):
+        return {
+            "stages": [
+                {
+                    "name": stage.name,
+                    "start": stage.start - self.origin,
+                    "duration": stage.duration,
+                    **stage.io,
+                } for stage in self.stages
+            ],
+            "posts": [
+                {
+                    "filename": timing.filename,
+                    "pid": timing.pid,
+                    "start": timing.start - self.origin,
+                    "parse": timing.parse,
+                    "render": timing.render,
+                    "write": timing.write,
+                    **timing.io,
+                } for timing in self.posts
+            ],
+        }
+    
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        
+        def us(seconds):
+            return round(seconds * 1000000)
+        
+        for stage in self.stages:
+            events.append({
+                "name": stage.name,
+                "cat": "stage",
+                "ph": "X",
+                "ts": us(stage.start - self.origin),
+                "dur": us(stage.duration),
+                "pid": pid,
+                "tid": 0,
+                "args": stage.io,
+            })
+        
+        for timing in self.posts:
+            start = timing.start - self.origin
+            
+            for step in ["parse", "render", "write"]:
+                duration = getattr(timing, step)
+                events.append({
+                    "name": step,
+                    "cat": "post",
+                    "ph": "X",
+                    "ts": us(start),
+                    "dur": us(duration),
+                    "pid": timing.pid,
+                    "tid": 1,
+                    "args": {"post": timing.filename},
+                })
+                start += duration
+        
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+    
+    def dump_json(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_json(), f, indent=1)
+    
+    def dump_chrome_trace(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
@@ -1,5 +1,6 @@
 
 RSS_FEED = "/feed.xml"
+ATOM_FEED = "/atom.xml"
 STATIC_FOLDER = "/"
 KEY_FOLDER = "/keys/"
 HOME_PAGE = "/index.html"
@@ -11,8 +12,20 @@ def post_folder(post):
 def post_page(post):
     return post_folder(post) + "index.html"
     
-def get_catlist_page(cat):
-    return f"/category/{cat.lower()}.html"
+# Listings are split into pages numbered from the oldest
+# post on. The newest of count pages is always found under
+# the route of the whole listing, so links to it never change.
+def get_postlist_page(number=None, count=None):
+    if number == count:
+        return POST_LISTING
+    
+    return f"/posts-{number}.html"
+    
+def get_catlist_page(cat, number=None, count=None):
+    if number == count:
+        return f"/category/{cat.lower()}.html"
+    
+    return f"/category/{cat.lower()}/{number}.html"
 
 def plugin_folder(name):
     return f"/plugin/{name}/"
@@ -0,0 +1,106 @@
+import os
+import sys
+import mimetypes
+import collections
+import http.server
+import urllib.parse
+
+from . import errors as biber_errors
+
+# How many rendered pages are kept in memory
+PAGE_CACHE_SIZE = 256
+
+class PageCache:
+    """
+    Keeps the most recently requested pages in memory.
+    Pages are stored under their route and dropped in
+    least recently used order once there are more than
+    size of them.
+    """
+    def __init__(self, size=PAGE_CACHE_SIZE):
+        self.size = size
+        self.pages = collections.OrderedDict()
+    
+    def get(self, route):
+        page = self.pages.get(route)
+        
+        if page is not None:
+            self.pages.move_to_end(route)
+        
+        return page
+    
+    def put(self, route, page):
+        self.pages[route] = page
+        self.pages.move_to_end(route)
+        
+        while len(self.pages) > self.size:
+            self.pages.popitem(last=False)
+    
+    def discard(self, route):
+        self.pages.pop(route, None)
+    
+    def clear(self):
+        self.pages.clear()
+
+def guess_type(route):
+    content_type, _ = mimetypes.guess_type(route)
+    
+    if content_type is None:
+        return "application/octet-stream"
+    if content_type.startswith("text/") or content_type in ["application/javascript", "application/xml"]:
+        content_type += "; charset=utf-8"
+    
+    return content_type
+
+# Maps a route to a file below root. Returns None if there is
+# no such file or the route tries to escape from root.
+def resolve_file(root, route):
+    root = os.path.abspath(root)
+    path = os.path.normpath(os.path.join(root, route.lstrip("/")))
+    
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return None
+    
+    return path
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.respond(True)
+    
+    def do_HEAD(self):
+        self.respond(False)
+    
+    def respond(self, send_body):
+        route = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        
+        try:
+            page = self.server.render(route)
+        except (biber_errors.BiberException, biber_errors.ThemeException) as e:
+            self.send_error(500, explain=str(e))
+            return
+        
+        if page is None:
+            self.send_error(404)
+            return
+        
+        data, content_type = page
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        
+        if send_body:
+            self.wfile.write(data)
+
+# Serves whatever render(route) returns, either None
+# or a tuple of the content as bytes and its type
+def serve(render, host, port):
+    server = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+    server.render = render
+    print(f"Serving on http://{host}:{port}/, press Ctrl+C to stop", file=sys.stderr)
+    
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import locale
+import argparse
+import platform
+import tempfile
+import subprocess
+sys.path.append("../..")
+
+import biber
+from biber import config as biber_config
+from biber import posts as biber_posts
+from biber import markdown, utils
+from biber import feed as biber_feed
+from biber.__main__ import load_plugins
+from biber.themes.akazie import index, postlist, catlist, static
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna aliqua".split()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the build pipeline on a synthetic blog")
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--images", type=int, default=2, help="images per post")
+    parser.add_argument("--code", type=int, default=3, help="code blocks per post")
+    parser.add_argument("--tables", type=int, default=1, help="tables per post")
+    parser.add_argument("--plugins", type=int, default=1, help="plugin invocations per post")
+    parser.add_argument("--paragraphs", type=int, default=20, help="paragraphs per post")
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of this many runs")
+    parser.add_argument("--seed", type=int, default=1337)
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file instead of stdout")
+    return parser.parse_args()
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def paragraph(rng):
+    parts = [sentence(rng, 12)]
+    parts.append(f"*{sentence(rng, 2)}*")
+    parts.append(f"**{sentence(rng, 2)}**")
+    parts.append(f"`{rng.choice(WORDS)}`")
+    parts.append(f"[{sentence(rng, 2)}](https://example.org/{rng.choice(WORDS)})")
+    parts.append(sentence(rng, 8) + ".")
+    return " ".join(parts)
+
+def generate_post(rng, args, number, categories):
+    out = [
+        "author: Benchmark",
+        f"date: {rng.randint(1, 28)}.{rng.randint(1, 12)}.{rng.randint(2010, 2030)}",
+        "categories: " + ", ".join(rng.sample(categories, min(3, len(categories)))),
+        f"title: Post {number} {sentence(rng, 4)}",
+        "",
+        f"# {sentence(rng, 3)}",
+        "",
+    ]
+    images = []
+    
+    for i in range(args.paragraphs):
+        out.append(paragraph(rng))
+        out.append("")
+        
+        if i % 5 == 0:
+            out.append(f"## {sentence(rng, 3)}")
+            out.append("")
+            out.append("> " + paragraph(rng))
+            out.append("")
+            out.extend(f"- {sentence(rng, 5)}" for _ in range(4))
+            out.append("")
+    
+    for i in range(args.images):
+        images.append(f"img/{i}.png")
+        out.append(f"![{sentence(rng, 2)}](img/{i}.png)")
+        out.append("")
+    
+    for i in range(args.code):
+        out.append("```code language=python line-numbers=yes")
+        out.extend(f"def f{j}(x):\n    return x * {j}" for j in range(10))
+        out.append("```")
+        out.append("")
+    
+    for i in range(args.tables):
+        out.append("| a | b | c |")
+        out.append("|---|---|---|")
+        out.extend(f"| *{j}* | {sentence(rng, 2)} | `{j}` |" for j in range(20))
+        out.append("")
+    
+    for i in range(args.plugins):
+        out.append("```latex")
+        out.append("e^{i \\pi} + 1 = 0")
+        out.append("```")
+        out.append("")
+    
+    return "\n".join(out), images
+
+def generate_blog(rng, args, root):
+    posts_dir = os.path.join(root, "posts")
+    categories = [f"cat{i}" for i in range(args.categories)]
+    
+    for number in range(args.posts):
+        content, images = generate_post(rng, args, number, categories)
+        post_dir = os.path.join(posts_dir, str(number))
+        os.makedirs(os.path.join(post_dir, "img"))
+        
+        with open(os.path.join(post_dir, "post.post"), "w") as f:
+            f.write(content)
+        
+        for img in images:
+            with open(os.path.join(post_dir, img), "wb") as f:
+                f.write(rng.randbytes(4096))
+    
+    config_file = os.path.join(root, "config")
+    
+    with open(config_file, "w") as f:
+        f.write("[Blog]\n")
+        f.write(f"in: {posts_dir}\n")
+        f.write(f"out: {os.path.join(root, 'out')}\n")
+        f.write("title: Benchmark\n")
+        f.write("domain: https://example.org\n")
+        f.write("theme: akazie\n")
+        f.write(f"plugins: {os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'plugins'))}\n")
+        f.write("\n[Feed]\nsize: 20\n")
+    
+    return config_file
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+    
+    def run(self, name, func, *args):
+        start = time.perf_counter()
+        ret = func(*args)
+        self.stages.setdefault(name, []).append(time.perf_counter() - start)
+        return ret
+
+def run_pipeline(timer, config_file):
+    config = biber_config.parse(config_file)
+    
+    # Every run starts cold, the listing index and the
+    # ids must not survive from the run before
+    shutil.rmtree(config["blog"]["out"], ignore_errors=True)
+    shutil.rmtree(config["cache"]["dir"], ignore_errors=True)
+    
+    try:
+        os.unlink(os.path.join(config["blog"]["in"], biber_posts.ID_INDEX_FILE))
+    except FileNotFoundError:
+        pass
+    
+    theme = config["blog"]["theme"]
+    plugins = load_plugins(config)
+    theme.initialize()
+    
+    posts = timer.run("create_post_listing", biber_posts.create_post_listing, config)
+    timer.run("create_post_listing (warm)", biber_posts.create_post_listing, config)
+    trees = timer.run("parse_markdown", lambda: [markdown.parse_markdown(post.get_markdown()) for post in posts])
+    bodies = timer.run("element_to_html", lambda: [theme.render_body(tree, plugins) for tree in trees])
+    timer.run("write_post_page", lambda: [theme.write_post_page(io.StringIO(), post, body, config, plugins) for post, body in zip(posts, bodies)])
+    
+    # The copies are only recorded here and timed on their own
+    jobs = utils.CopyJobs()
+    timer.run("generate_post", lambda: [theme.generate_post(post, body, config, plugins, jobs) for post, body in zip(posts, bodies)])
+    timer.run("copy_assets", lambda: [utils.create_copy(src, dst, mode) for src, dst, mode in jobs])
+    
+    def generate_pages():
+        categories = biber_posts.CategoryIndex(posts)
+        index.generate_index(config, posts, categories)
+        postlist.generate_postlist(config, posts)
+        catlist.generate_catlists(config, categories)
+    
+    timer.run("generate_pages", generate_pages)
+    html = { post.filename : body.html for post, body in zip(posts, bodies) }
+    timer.run("generate_feed", biber_feed.generate_feed, config, list(reversed(posts[-config["feed"]["size"]:])), lambda post: html[post.filename])
+    timer.run("copy_static_files", static.copy_static_files, config)
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            check=True,
+            text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    args = parse_args()
+    
+    try:
+        locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
+    except locale.Error:
+        locale.setlocale(locale.LC_ALL, '')
+    
+    timer = Timer()
+    
+    with tempfile.TemporaryDirectory(prefix="biber-bench-") as root:
+        config_file = generate_blog(random.Random(args.seed), args, root)
+        
+        for _ in range(args.repeat):
+            run_pipeline(timer, config_file)
+    
+    results = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "params": {
+            key: value for key, value in vars(args).items() if key != "output"
+        },
+        "stages": {
+            name: {
+                "best": min(runs),
+                "runs": runs,
+            } for name, runs in timer.stages.items()
+        },
+    }
+    # The warm listing repeats the cold one, it doesn't add to a build
+    results["total"] = sum(stage["best"] for name, stage in results["stages"].items() if not name.endswith("(warm)"))
+    
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
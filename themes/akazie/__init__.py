@@ -1,14 +1,16 @@
+from .post import generate_post, write_post_page, copy_plugin_files, render_body, get_plugin_dir, element_to_html, register_renderer, RenderContext, RENDERER_VERSION
+from .templates import initialize, compile_templates, get_templates_dir, get_template_files, TEMPLATE_PAGES
 
-from .post import generate_post, element_to_html
-from .templates import initialize
+from .index import generate_index, render_index
+from .static import copy_static_files, get_static_dir
+from .postlist import generate_postlist, render_postlist
+from .catlist import generate_catlists, render_catlist
 
-from .index import generate_index as _generate_index
-from .static import copy_static_files as _copy_static_files
-from .postlist import generate_postlist as _generate_postlist
-from .catlist import generate_catlists as _generate_catlists
-
-def generate_pages(config, posts):
-    _generate_index(config, posts)
-    _generate_postlist(config, posts)
-    _generate_catlists(config, posts)
-    _copy_static_files(config)
+# Generates all pages besides the posts. If postlists or
+# catlists are given only those pages of the listings are
+# generated, see generate_postlist() and generate_catlists().
+def generate_pages(config, posts, categories, postlists=None, catlists=None):
+    generate_index(config, posts, categories)
+    generate_postlist(config, posts, postlists)
+    generate_catlists(config, categories, catlists)
+    copy_static_files(config)
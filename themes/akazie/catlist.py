@@ -1,11 +1,9 @@
-from ... import routes, utils
+from ... import routes, utils, posts as biber_posts
 from . import templates
 
-def generate_catlist(config, posts, cat):
-    out_file = utils.join_paths(
-        config["blog"]["out"],
-        routes.get_catlist_page(cat)
-    )
+# Renders the page with the given number of the listing
+# of a category, the newest one if no number is given
+def render_catlist(config, categories, cat, number=None):
     stylesheets = [
         utils.join_paths(routes.STATIC_FOLDER, "css", "bootstrap.css"),
         utils.join_paths(routes.STATIC_FOLDER, "css", "common.css"),
@@ -16,31 +14,49 @@ def generate_catlist(config, posts, cat):
         utils.join_paths(routes.STATIC_FOLDER, "js", "bootstrap.bundle.min.js"),
         utils.join_paths(routes.STATIC_FOLDER, "js", "init_bootstrap.js"),
     ]
-    selected_posts = []
+    pages = biber_posts.paginate(categories[cat], config["blog"]["page-size"])
+    count = len(pages)
+    
+    if number is None:
+        number = count
+    
+    return templates.create_catlist(
+        blog_title=config["blog"]["title"],
+        stylesheets=stylesheets,
+        scripts=scripts,
+        static_folder=routes.STATIC_FOLDER,
+        socials=config["socials"],
+        posts=reversed(pages[number - 1]),
+        get_post_route=routes.post_page,
+        get_cat_route=routes.get_catlist_page,
+        cat=cat.lower(),
+        older_page=routes.get_catlist_page(cat, number - 1, count) if number > 1 else None,
+        newer_page=routes.get_catlist_page(cat, number + 1, count) if number < count else None,
+    )
+
+# Generates all pages of the listing of a category
+# or, if given, only those with the numbers in only
+def generate_catlist(config, categories, cat, only=None):
+    count = len(biber_posts.paginate(categories[cat], config["blog"]["page-size"]))
     
-    for post in posts:
-        if cat in post.metadata.categories:
-            selected_posts.append(post)
+    if only is None:
+        only = range(1, count + 1)
     
-    with utils.create_open(out_file) as f:
-        f.write(templates.create_catlist(
-            blog_title=config["blog"]["title"],
-            stylesheets=stylesheets,
-            scripts=scripts,
-            static_folder=routes.STATIC_FOLDER,
-            socials=config["socials"],
-            posts=reversed(selected_posts),
-            get_post_route=routes.post_page,
-            get_cat_route=routes.get_catlist_page,
-            cat=cat.lower(),
-        ))
+    for number in only:
+        out_file = utils.join_paths(
+            config["blog"]["out"],
+            routes.get_catlist_page(cat, number, count)
+        )
+        
+        with utils.create_open(out_file) as f:
+            f.write(render_catlist(config, categories, cat, number))
 
-def generate_catlists(config, posts):
-    cats = set()
+# Generates the pages of all categories or, if given,
+# only those in only which maps categories to the
+# numbers of their pages
+def generate_catlists(config, categories, only=None):
+    if only is None:
+        only = dict.fromkeys(categories)
     
-    for post in posts:
-        for cat in post.metadata.categories:
-            cats.add(cat)
-            
-    for cat in cats:
-        generate_catlist(config, posts, cat)
+    for cat, numbers in only.items():
+        generate_catlist(config, categories, cat, numbers)
@@ -6,69 +6,96 @@ import sys
 import html
 import shutil
 
-used_images = set()
-used_plugins = set()
+# Bump this whenever the HTML generated for an element
+# tree changes, it invalidates all cached post bodies
+RENDERER_VERSION = 1
 
-def heading_to_html(heading):
+class RenderContext:
+    """
+    Per-render state that is threaded through
+    element_to_html(). It collects the generated HTML
+    and records the assets the rendered elements need
+    so that no module-global state is involved and
+    posts can be rendered concurrently.
+    """
+    def __init__(self, plugins=None, out=None):
+        self.plugins = plugins
+        self.images = set()
+        self.used_plugins = set()
+        
+        # All renderers append their fragments to one
+        # shared buffer instead of returning lists
+        if out is None:
+            out = []
+        
+        self.out = out
+        self.write = out.append
+
+class PostBody:
+    """
+    The rendered body of a post together with the
+    assets it needs. It does not depend on anything
+    but the element tree and the plugins so it can
+    be cached and wrapped into the page later.
+    """
+    def __init__(self, html, images, used_plugins):
+        self.html = html
+        self.images = images
+        self.used_plugins = used_plugins
+
+def heading_to_html(heading, context):
     fmt_open_tag = '<h{} class="heading">'
     fmt_close_tag = "</h{}>"
     
-    ret = [
-        fmt_open_tag.format(heading.level + 1)
-    ]
+    context.write(fmt_open_tag.format(heading.level + 1))
     
     for subel in heading:
-        ret.extend(element_to_html(subel))
+        element_to_html(subel, context)
     
-    ret.append(fmt_close_tag.format(heading.level + 1))
-    return ret
+    context.write(fmt_close_tag.format(heading.level + 1))
     
-def text_to_html(text):
-    return [text]
+def text_to_html(text, context):
+    context.write(text)
     
-def paragraph_to_html(paragraph):
-    ret = ["<p>"]
+def paragraph_to_html(paragraph, context):
+    context.write("<p>")
     
     for subel in paragraph:
-        ret.extend(element_to_html(subel))
+        element_to_html(subel, context)
     
-    ret.append("</p>")
-    return ret
+    context.write("</p>")
     
-def strong_to_html(strong):
-    ret = ["<b>"]
+def strong_to_html(strong, context):
+    context.write("<b>")
     
     for subel in strong:
-        ret.extend(element_to_html(subel))
+        element_to_html(subel, context)
     
-    ret.append("</b>")
-    return ret
+    context.write("</b>")
     
-def linebreak_to_html(linebreak):
-    return ["<br>"]
+def linebreak_to_html(linebreak, context):
+    context.write("<br>")
 
-def emphasis_to_html(emphasis):
-    ret = ["<em>" * emphasis.strength]
+def emphasis_to_html(emphasis, context):
+    context.write("<em>" * emphasis.strength)
     
     for subel in emphasis:
-        ret.extend(element_to_html(subel))
+        element_to_html(subel, context)
     
-    ret.append("</em>" * emphasis.strength)
-    return ret
+    context.write("</em>" * emphasis.strength)
     
-def block_to_html(block):
-    global used_plugins
-    used_plugins.add("code")
+def block_to_html(block, context):
+    context.used_plugins.add("code")
     
-    return [
-        '<pre><code class="language-none">'
-        + html.escape(block)
-        + '</code></pre>'
-    ]
+    context.write('<pre><code class="language-none">')
+    context.write(html.escape(block))
+    context.write('</code></pre>')
     
-def plugin_to_html(block, plugins):
-    global used_plugins
-    used_plugins.add(block.name)
+def plugin_to_html(block, context):
+    if context.plugins is None:
+        raise ThemeException(f"Trying to invoke plugin without a valid plugin list")
+    
+    context.used_plugins.add(block.name)
     
     # The "code" plugin is built in 
     if block.name == "code":
@@ -93,217 +120,226 @@ def plugin_to_html(block, plugins):
         except ValueError:
             raise ThemeException(f"Invalid line-start argument: {block.args['line-start']}")
         
-        return [
-            f'<pre data-start="{lstart}" class="{lnos}"><code class="language-{lang}">'
-            + html.escape(block.content)
-            + '</code></pre>'
-        ]
+        context.write(f'<pre data-start="{lstart}" class="{lnos}"><code class="language-{lang}">')
+        context.write(html.escape(block.content))
+        context.write('</code></pre>')
     else:
-        if block.name not in plugins:
+        if block.name not in context.plugins:
             raise ThemeException(f"Plugin {block.name} not found")
-            
-        return plugins[block.name].generate_content(block.content, block.args)
+        
+        # Plugins hand back a list of html fragments
+        context.out.extend(context.plugins[block.name].generate_content(block.content, block.args))
 
-def unordered_list_to_html(element):
-    ret = ["<ul>"]
+def unordered_list_to_html(element, context):
+    context.write("<ul>")
     
     for item in element.items:
         if not isinstance(item, elements.ListItem):
             raise ThemeException(f"Items of unordered list are not classical list items")
         
-        ret.append("<li>")
+        context.write("<li>")
         
         for subel in item:
-            ret.extend(element_to_html(subel))
+            element_to_html(subel, context)
         
-        ret.append("</li>")
+        context.write("</li>")
     
-    ret.append("</ul>")
-    return ret
+    context.write("</ul>")
 
-def ordered_list_to_html(element):
-    ret = ['<ol>']
+def ordered_list_to_html(element, context):
+    context.write('<ol>')
     
     for item in element.items:
         if not isinstance(item, elements.ListItem):
             raise ThemeException(f"Items of unordered list are not classical list items")
         
-        ret.append("<li>")
+        context.write("<li>")
         
         for subel in item:
-            ret.extend(element_to_html(subel))
+            element_to_html(subel, context)
         
-        ret.append("</li>")
+        context.write("</li>")
     
-    ret.append("</ol>")
-    return ret
+    context.write("</ol>")
 
-def tag_to_html(element):
-    return [
-        '<code class="language-none">' + element + '</code>'
-    ]
+def tag_to_html(element, context):
+    context.write('<code class="language-none">')
+    context.write(element)
+    context.write('</code>')
     
-def quote_to_html(element):
-    ret = ['<div class="quote">']
+def quote_to_html(element, context):
+    context.write('<div class="quote">')
     
     for subel in element:
-        ret.extend(element_to_html(subel))
+        element_to_html(subel, context)
     
-    ret.append("</div>")
-    return ret
+    context.write("</div>")
 
-def link_to_html(element):
-    ret = [f'<a href="{element.href}" target="_blank">']
+def link_to_html(element, context):
+    context.write(f'<a href="{element.href}" target="_blank">')
     
     for subel in element:
-        ret.extend(element_to_html(subel))
+        element_to_html(subel, context)
     
-    ret.append('</a>')
-    return ret
+    context.write('</a>')
 
-def image_to_html(element):
-    global used_images
-    used_images.add(element.src)
+def image_to_html(element, context):
+    context.images.add(element.src)
     
-    ret = [f'<center><img class="figure" src="{element.src}" alt="']
+    context.write(f'<center><img class="figure" src="{element.src}" alt="')
     
     for subel in element.alt:
-        ret.extend(element_to_html(subel))
+        element_to_html(subel, context)
         
-    ret.append('"></center>')
-    return ret
+    context.write('"></center>')
 
-def table_to_html(table):
-    ret = ['<table class="table table-striped">']
+def table_to_html(table, context):
+    context.write('<table class="table table-striped">')
     
     if table.head is not None:
-        ret.append("<thead>")
-        ret.extend(element_to_html(table.head))
-        ret.append("</thead>")
+        context.write("<thead>")
+        element_to_html(table.head, context)
+        context.write("</thead>")
         
-    ret.append("<tbody>")
+    context.write("<tbody>")
         
     for row in table.body:
-        ret.extend(element_to_html(row))
+        element_to_html(row, context)
     
-    ret.append("</tbody>")
+    context.write("</tbody>")
     
-    ret.append("</table>")
-    return ret
+    context.write("</table>")
 
-def trow_to_html(row):
-    ret = ["<tr>"]
+def trow_to_html(row, context):
+    context.write("<tr>")
     
     for subel in row:
         if isinstance(subel, elements.Td):
-            ret.append("<td>")
+            context.write("<td>")
             for subsubel in subel:
-                ret.extend(element_to_html(subsubel))
-            ret.append("</td>")
+                element_to_html(subsubel, context)
+            context.write("</td>")
         elif isinstance(subel, elements.Th):
-            ret.append("<th>")
+            context.write("<th>")
             for subsubel in subel:
-                ret.extend(element_to_html(subsubel))
-            ret.append("</th>")
+                element_to_html(subsubel, context)
+            context.write("</th>")
     
-    ret.append("</tr>")
-    return ret
+    context.write("</tr>")
 
-def element_to_html(element, plugins=None):
-    if not isinstance(element, elements.Element):
-        raise ThemeException(f"Tried to convert an invalid element to html: {element}")
-    
-    if isinstance(element, elements.Heading):
-        return heading_to_html(element)
-    elif isinstance(element, elements.Text):
-        return text_to_html(element)
-    elif isinstance(element, elements.Paragraph):
-        return paragraph_to_html(element)
-    elif isinstance(element, elements.Strong):
-        return strong_to_html(element)
-    elif isinstance(element, elements.LineBreak):
-        return linebreak_to_html(element)
-    elif isinstance(element, elements.Emphasis):
-        return emphasis_to_html(element)
-    elif isinstance(element, elements.Block):
-        return block_to_html(element)
-    elif isinstance(element, elements.PluginInvocation):
-        if plugins is None:
-            raise ThemeException(f"Trying to invoke plugin without a valid plugin list")
-        
-        return plugin_to_html(element, plugins)
-    elif isinstance(element, elements.UnorderedList):
-        return unordered_list_to_html(element)
-    elif isinstance(element, elements.OrderedList):
-        return ordered_list_to_html(element)
-    elif isinstance(element, elements.Tag):
-        return tag_to_html(element)
-    elif isinstance(element, elements.Quote):
-        return quote_to_html(element)
-    elif isinstance(element, elements.Link):
-        return link_to_html(element)
-    elif isinstance(element, elements.Image):
-        return image_to_html(element)
-    elif isinstance(element, elements.Table):
-        return table_to_html(element)
-    elif isinstance(element, elements.Trow):
-        return trow_to_html(element)
-    else:
-        raise ThemeException(f"Invalid element: {type(element)}")
+# Maps element classes to the functions that render them.
+# Themes and plugins can add their own element types with
+# register_renderer().
+RENDERERS = {
+    elements.Heading : heading_to_html,
+    elements.Text : text_to_html,
+    elements.Paragraph : paragraph_to_html,
+    elements.Strong : strong_to_html,
+    elements.LineBreak : linebreak_to_html,
+    elements.Emphasis : emphasis_to_html,
+    elements.Block : block_to_html,
+    elements.PluginInvocation : plugin_to_html,
+    elements.UnorderedList : unordered_list_to_html,
+    elements.OrderedList : ordered_list_to_html,
+    elements.Tag : tag_to_html,
+    elements.Quote : quote_to_html,
+    elements.Link : link_to_html,
+    elements.Image : image_to_html,
+    elements.Table : table_to_html,
+    elements.Trow : trow_to_html,
+}
+
+# Renderers resolved for concrete classes, including
+# subclasses of registered element types
+resolved_renderers = dict(RENDERERS)
+
+def register_renderer(element_type, renderer):
+    if not isinstance(element_type, type) or not issubclass(element_type, elements.Element):
+        raise ThemeException(f"Cannot register a renderer for a non-element type: {element_type}")
+    
+    RENDERERS[element_type] = renderer
+    resolved_renderers.clear()
+    resolved_renderers.update(RENDERERS)
 
-def handle_plugins(config, plugins):
-    global used_plugins
+def resolve_renderer(element_type):
+    for base in element_type.__mro__:
+        if base in RENDERERS:
+            resolved_renderers[element_type] = RENDERERS[base]
+            return RENDERERS[base]
+    
+    if not issubclass(element_type, elements.Element):
+        raise ThemeException(f"Tried to convert an invalid element to html: {element_type}")
+    
+    raise ThemeException(f"Invalid element: {element_type}")
+
+def element_to_html(element, context):
+    try:
+        renderer = resolved_renderers[type(element)]
+    except KeyError:
+        renderer = resolve_renderer(type(element))
+    
+    renderer(element, context)
+
+def get_plugin_dir(config, name):
+    plugin_dir = utils.join_paths(config["blog"]["plugins"], name)
+    
+    if not os.path.isdir(plugin_dir):
+        plugin_dir = config["blog"]["plugins"]
+    
+    return plugin_dir
+
+# The script/style tags the used plugins need
+def get_plugin_assets(plugins, used_plugins):
     styles = []
     scripts = []
     
     if "code" in used_plugins:
         styles.append(utils.join_paths(routes.STATIC_FOLDER, "css", "prism.css"))
         scripts.append(utils.join_paths(routes.STATIC_FOLDER, "js", "prism.js"))
-        used_plugins.remove("code")
     
-    for name in used_plugins:
-        plugin_dir = utils.join_paths(config["blog"]["plugins"], name)
-        if not os.path.isdir(plugin_dir):
-            plugin_dir = config["blog"]["plugins"]
-        
-        out_dir = utils.join_paths(config["blog"]["out"], routes.plugin_folder(name))
+    # Sorted so that the page comes out the same every time
+    for name in sorted(used_plugins):
+        if name == "code":
+            continue
         
         for filename in plugins[name].EXTRA_SCRIPTS:
-            utils.create_copy(
-                utils.join_paths(plugin_dir, filename),
-                utils.join_paths(out_dir, filename)
-            )
             scripts.append(
                 utils.join_paths(routes.plugin_folder(name), filename)
             )
             
         for filename in plugins[name].EXTRA_STYLESHEETS:
-            utils.create_copy(
-                utils.join_paths(plugin_dir, filename),
-                utils.join_paths(out_dir, filename)
-            )
             styles.append(
                 utils.join_paths(routes.plugin_folder(name), filename)
             )
-            
-        for filename in plugins[name].EXTRA_FILES:
-            utils.create_copy(
-                utils.join_paths(plugin_dir, filename),
-                utils.join_paths(out_dir, filename)
-            )
-    
-    used_plugins.clear()
     
     return scripts, styles
 
-def generate_post(post, tree, config, plugins):
-    global used_images
+def copy_plugin_files(config, plugins, used_plugins, copy=utils.create_copy):
+    for name in used_plugins:
+        if name == "code":
+            continue
+        
+        plugin_dir = get_plugin_dir(config, name)
+        out_dir = utils.join_paths(config["blog"]["out"], routes.plugin_folder(name))
+        mod = plugins[name]
+        
+        for filename in [*mod.EXTRA_SCRIPTS, *mod.EXTRA_STYLESHEETS, *mod.EXTRA_FILES]:
+            copy(
+                utils.join_paths(plugin_dir, filename),
+                utils.join_paths(out_dir, filename),
+                config["blog"]["copy-mode"]
+            )
+
+def render_body(tree, plugins):
+    context = RenderContext(plugins)
     
-    out_file = utils.join_paths(
-        config["blog"]["out"],
-        routes.post_page(post)
-    )
+    for element in tree:
+        element_to_html(element, context)
     
+    return PostBody("".join(context.out), context.images, context.used_plugins)
+
+# Writes the complete page of a post into f
+def write_post_page(f, post, body, config, plugins):
     stylesheets = [
         utils.join_paths(routes.STATIC_FOLDER, "css", "bootstrap.css"),
         utils.join_paths(routes.STATIC_FOLDER, "css", "common.css"),
@@ -314,33 +350,41 @@ def generate_post(post, tree, config, plugins):
         utils.join_paths(routes.STATIC_FOLDER, "js", "bootstrap.bundle.min.js"),
         utils.join_paths(routes.STATIC_FOLDER, "js", "init_bootstrap.js"),
     ]
-    elements = []
+    # Insert necessary script/style tags
+    extra_scripts, extra_styles = get_plugin_assets(plugins, body.used_plugins)
+    
+    templates.write_post(f,
+        title=post.metadata.title,
+        stylesheets=stylesheets + extra_styles,
+        scripts=scripts + extra_scripts,
+        static_folder=routes.STATIC_FOLDER,
+        blog_title=config["blog"]["title"],
+        socials=config["socials"],
+        home_page=routes.HOME_PAGE,
+        body=body.html,
+        post_date=post.metadata.format_date(),
+        categories=map(lambda x: (x, routes.get_catlist_page(x)), post.metadata.categories)
+    )
+
+# The images, attachments and plugin files are handed to
+# assets, usually a utils.CopyQueue, if given and copied
+# right away otherwise
+def generate_post(post, body, config, plugins, assets=None):
+    out_file = utils.join_paths(
+        config["blog"]["out"],
+        routes.post_page(post)
+    )
+    copy = utils.create_copy if assets is None else assets.copy
     
-    for element in tree:
-        elements.extend(element_to_html(element, plugins))
+    with utils.create_open(out_file) as f:
+        write_post_page(f, post, body, config, plugins)
     
-    # Copy the plugin files and insert necessary script/style tags
-    extra_scripts, extra_styles = handle_plugins(config, plugins)
+    copy_plugin_files(config, plugins, body.used_plugins, copy)
     
-    with utils.create_open(out_file) as f:
-        f.write(templates.create_post(
-            title=post.metadata.title,
-            stylesheets=stylesheets + extra_styles,
-            scripts=scripts + extra_scripts,
-            static_folder=routes.STATIC_FOLDER,
-            blog_title=config["blog"]["title"],
-            socials=config["socials"],
-            home_page=routes.HOME_PAGE,
-            elements=elements,
-            post_date=post.metadata.format_date(),
-            categories=map(lambda x: (x, routes.get_catlist_page(x)), post.metadata.categories)
-        ))
-        
-    for img in used_images:
+    for img in body.images:
         input = utils.join_paths(os.path.dirname(post.filename), img)
         output = utils.join_paths(os.path.dirname(out_file), img)
-        utils.create_copy(input, output)
-    used_images.clear()
+        copy(input, output, config["blog"]["copy-mode"])
     
     #TODO: handle sign
     
@@ -354,4 +398,6 @@ def generate_post(post, tree, config, plugins):
             routes.post_folder(post),
             att
         )
-        utils.create_copy(input_file, output_file)
+        copy(input_file, output_file, config["blog"]["copy-mode"])
+    
+    return body.images, body.used_plugins
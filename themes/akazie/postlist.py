@@ -1,11 +1,9 @@
-from ... import routes, utils
+from ... import routes, utils, posts as biber_posts
 from . import templates
 
-def generate_postlist(config, posts):
-    out_file = utils.join_paths(
-        config["blog"]["out"],
-        routes.POST_LISTING
-    )
+# Renders the page with the given number of the
+# post listing, the newest one if no number is given
+def render_postlist(config, posts, number=None):
     stylesheets = [
         utils.join_paths(routes.STATIC_FOLDER, "css", "bootstrap.css"),
         utils.join_paths(routes.STATIC_FOLDER, "css", "common.css"),
@@ -16,15 +14,38 @@ def generate_postlist(config, posts):
         utils.join_paths(routes.STATIC_FOLDER, "js", "bootstrap.bundle.min.js"),
         utils.join_paths(routes.STATIC_FOLDER, "js", "init_bootstrap.js"),
     ]
+    pages = biber_posts.paginate(posts, config["blog"]["page-size"])
+    count = len(pages)
+    
+    if number is None:
+        number = count
+    
+    return templates.create_postlist(
+        blog_title=config["blog"]["title"],
+        stylesheets=stylesheets,
+        scripts=scripts,
+        static_folder=routes.STATIC_FOLDER,
+        socials=config["socials"],
+        posts=reversed(pages[number - 1]),
+        get_post_route=routes.post_page,
+        get_cat_route=routes.get_catlist_page,
+        older_page=routes.get_postlist_page(number - 1, count) if number > 1 else None,
+        newer_page=routes.get_postlist_page(number + 1, count) if number < count else None,
+    )
+
+# Generates all pages of the post listing or,
+# if given, only those with the numbers in only
+def generate_postlist(config, posts, only=None):
+    count = len(biber_posts.paginate(posts, config["blog"]["page-size"]))
+    
+    if only is None:
+        only = range(1, count + 1)
     
-    with utils.create_open(out_file) as f:
-        f.write(templates.create_postlist(
-            blog_title=config["blog"]["title"],
-            stylesheets=stylesheets,
-            scripts=scripts,
-            static_folder=routes.STATIC_FOLDER,
-            socials=config["socials"],
-            posts=reversed(posts),
-            get_post_route=routes.post_page,
-            get_cat_route=routes.get_catlist_page,
-        ))
+    for number in only:
+        out_file = utils.join_paths(
+            config["blog"]["out"],
+            routes.get_postlist_page(number, count)
+        )
+        
+        with utils.create_open(out_file) as f:
+            f.write(render_postlist(config, posts, number))
@@ -1,21 +1,23 @@
 
 import os
 import sys
-import shutil
 
 from ... import utils, routes
 
-def copy_static_files(config):
-    input_dir = utils.join_paths(
+def get_static_dir():
+    return utils.join_paths(
         os.path.dirname(sys.modules["biber"].__path__[0]),
         "biber",
         "themes",
         "akazie",
         "static"
     )
+
+def copy_static_files(config):
+    input_dir = get_static_dir()
     output_dir = utils.join_paths(
         config["blog"]["out"],
         routes.STATIC_FOLDER
     )
     
-    shutil.copytree(input_dir, output_dir, dirs_exist_ok=True)
+    utils.sync_tree(input_dir, output_dir, config["blog"]["copy-mode"])
@@ -2,37 +2,107 @@ import os
 import sys
 import jinja2
 
+from ... import cache
+
 environment = None
 
-def initialize():
-    global environment
-    templates_dir = os.path.join(
+# Which kind of page every template renders
+TEMPLATE_PAGES = {
+    "post.html" : "post",
+    "index.html" : "index",
+    "postlist.html" : "postlist",
+    "catlist.html" : "catlist",
+}
+
+def get_templates_dir():
+    return os.path.join(
         os.path.dirname(sys.modules["biber"].__path__[0]),
         "biber",
         "themes",
         "akazie",
         "templates"
     )
+
+# All template files or only those that go
+# into the given kind of page
+def get_template_files(page=None):
+    templates_dir = get_templates_dir()
+    return sorted(
+        os.path.join(templates_dir, entry) for entry in os.listdir(templates_dir)
+        if page is None or TEMPLATE_PAGES.get(entry) == page
+    )
+
+class CacheBytecodeCache(jinja2.BytecodeCache):
+    """
+    Keeps the compiled templates in the build cache so that
+    a fresh process doesn't have to compile them again.
+    Jinja checks the checksum of the template source itself
+    and ignores bytecode of an outdated template.
+    """
+    def __init__(self, store):
+        self.store = store
+    
+    def load_bytecode(self, bucket):
+        data = self.store.get("templates", cache.make_key(bucket.key))
+        
+        if data is not None:
+            bucket.bytecode_from_string(data)
+    
+    def dump_bytecode(self, bucket):
+        self.store.put("templates", cache.make_key(bucket.key), bucket.bytecode_to_string())
+
+# Templates are loaded once and then kept here, with
+# auto_reload they are loaded again when their file changes
+compiled = {}
+
+# Without a config the templates are compiled in every process
+def initialize(config=None, auto_reload=True):
+    global environment
+    bytecode_cache = None
+    
+    if config is not None:
+        bytecode_cache = CacheBytecodeCache(cache.open_cache(config))
+    
     environment = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(templates_dir)
+        loader=jinja2.FileSystemLoader(get_templates_dir()),
+        bytecode_cache=bytecode_cache,
+        auto_reload=auto_reload
     )
+    compiled.clear()
+
+def get_template(name):
+    template = compiled.get(name)
+    
+    if template is None or (environment.auto_reload and not template.is_up_to_date):
+        template = environment.get_template(name)
+        compiled[name] = template
     
+    return template
+
+# Loads all templates ahead of time, which also
+# puts them into the bytecode cache
+def compile_templates():
+    for name in TEMPLATE_PAGES:
+        get_template(name)
+
 def create_post(**kwargs):
-    global environment
-    template = environment.get_template("post.html")
+    template = get_template("post.html")
     return template.render(kwargs)
 
+# Like create_post() but streams the page into
+# the file instead of building it in memory
+def write_post(f, **kwargs):
+    template = get_template("post.html")
+    template.stream(kwargs).dump(f)
+
 def create_index(**kwargs):
-    global environment
-    template = environment.get_template("index.html")
+    template = get_template("index.html")
     return template.render(kwargs)
 
 def create_postlist(**kwargs):
-    global environment
-    template = environment.get_template("postlist.html")
+    template = get_template("postlist.html")
     return template.render(kwargs)
-    
+
 def create_catlist(**kwargs):
-    global environment
-    template = environment.get_template("catlist.html")
+    template = get_template("catlist.html")
     return template.render(kwargs)
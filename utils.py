@@ -1,16 +1,92 @@
 import os
 import shutil
+import hashlib
+import tempfile
+import threading
+import contextlib
+import concurrent.futures
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .errors import ParsingException
 
 # Join paths but convert absolute path
 # components to relative path components
 def join_paths(*parts):
     return os.path.join(parts[0], *map(lambda x: x[1:] if x[0] == "/" else x, parts[1:]))
 
+# How much output this process produced, the
+# profiler takes snapshots of it around every stage.
+# Skipped files already had the right content.
+io_stats = {
+    "files_written" : 0,
+    "bytes_written" : 0,
+    "files_copied" : 0,
+    "bytes_copied" : 0,
+    "files_skipped" : 0,
+}
+
+# The copy queue updates the counters from several threads
+io_lock = threading.Lock()
+
+def count_io(key, value=1):
+    with io_lock:
+        io_stats[key] += value
+
+# tempfile.mkstemp() creates files that only the owner
+# can read, output files get the usual permissions instead
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def same_content(a, b):
+    try:
+        if os.path.getsize(a) != os.path.getsize(b):
+            return False
+        
+        with open(a, "rb") as fa, open(b, "rb") as fb:
+            while True:
+                chunk = fa.read(1 << 16)
+                
+                if chunk != fb.read(1 << 16):
+                    return False
+                if not chunk:
+                    return True
+    except OSError:
+        return False
+
 # Given a path to a file, first create all containing
-# folders and then create the file
+# folders and then create the file. Everything is written
+# to a temporary file first that atomically replaces the
+# file, but only if the content differs. Unchanged files
+# keep their mtime so that deployment tools skip them.
+@contextlib.contextmanager
 def create_open(path):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    return open(path, "w")
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    
+    try:
+        with os.fdopen(fd, "w") as f:
+            yield f
+        
+        if same_content(tmp, path):
+            os.unlink(tmp)
+            count_io("files_skipped")
+            return
+        
+        size = os.path.getsize(tmp)
+        os.chmod(tmp, 0o666 & ~UMASK)
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    
+    count_io("files_written")
+    count_io("bytes_written", size)
     
 def next_escaped(input, sep, escape=[]):
     assert(len(sep) == 1)
@@ -35,9 +111,182 @@ def next_escaped(input, sep, escape=[]):
     
     return (res, "")
     
-def create_copy(src, dst):
-    if os.path.isfile(dst):
+# How create_copy() puts files into the output directory:
+# "copy" duplicates the bytes, "hardlink" links the output to
+# the input and "reflink" lets the filesystem share the data
+# between both. The latter two fall back to copying.
+COPY_MODES = ["copy", "hardlink", "reflink"]
+
+# FICLONE from linux/fs.h, shares all extents of a file
+# on filesystems with copy-on-write like btrfs or XFS
+FICLONE = 0x40049409
+
+# Content hash -> the first output file with that content.
+# In the reflink mode identical files are only stored once.
+# Hard links would tie the output to the source of another
+# post, which could then change it behind our back.
+copied_hashes = {}
+
+# Whether dst is not (or no longer) a copy of src
+def is_stale(src, dst):
+    try:
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return True
+    
+    if os.path.samestat(src_stat, dst_stat):
+        return False
+    
+    # Linked to some other file, possibly by an older version
+    # that shared identical files between posts
+    if dst_stat.st_nlink > 1:
+        return True
+    if src_stat.st_size != dst_stat.st_size:
+        return True
+    
+    # copy_file() keeps the mtime so this is the common case
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return False
+    
+    return hash_file(src) != hash_file(dst)
+
+def create_copy(src, dst, mode="copy"):
+    if not is_stale(src, dst):
+        count_io("files_skipped")
         return
     
     os.makedirs(os.path.dirname(dst), exist_ok=True)
-    shutil.copyfile(src, dst)
+    
+    if mode == "reflink":
+        digest = hash_file(src)
+        first = copied_hashes.setdefault(digest, dst)
+        
+        if first != dst and hash_file(first) == digest:
+            # Share the data with the identical file we already have
+            src = first
+    
+    copy_file(src, dst, mode)
+
+# Returns whether the filesystem shares the data of both files
+def reflink_file(src, dst):
+    shared = False
+    
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shared = True
+        except (AttributeError, OSError):
+            # copy_file_range() can still share the data on some
+            # filesystems and at least stays inside the kernel
+            if not hasattr(os, "copy_file_range"):
+                shutil.copyfileobj(fsrc, fdst)
+            else:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30) > 0:
+                    pass
+    
+    shutil.copystat(src, dst)
+    return shared
+
+# Puts a copy of src at dst in the given mode and replaces dst
+# atomically. Linked and cloned files count as copied but the
+# bytes are only counted when they were duplicated.
+def copy_file(src, dst, mode="copy"):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=".tmp-")
+    os.close(fd)
+    copied = True
+    
+    try:
+        if mode == "hardlink":
+            os.unlink(tmp)
+            
+            try:
+                os.link(src, tmp)
+                copied = False
+            except OSError:
+                # Links do not work across filesystems
+                shutil.copy2(src, tmp)
+        elif mode == "reflink":
+            copied = not reflink_file(src, tmp)
+        else:
+            shutil.copy2(src, tmp)
+        
+        os.replace(tmp, dst)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    
+    count_io("files_copied")
+    
+    if copied:
+        count_io("bytes_copied", os.path.getsize(dst))
+    
+    return dst
+
+# How many files the copy queue copies at the same time
+COPY_THREADS = 8
+
+class CopyQueue:
+    """
+    Runs create_copy() in a pool of threads so that
+    copying assets overlaps with rendering. Every
+    destination is only copied once. wait() blocks until
+    all copies are done and raises the first error.
+    """
+    def __init__(self, threads=COPY_THREADS):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.futures = {}
+    
+    def copy(self, src, dst, mode="copy"):
+        if dst not in self.futures:
+            self.futures[dst] = self.executor.submit(create_copy, src, dst, mode)
+    
+    def wait(self):
+        try:
+            for future in self.futures.values():
+                future.result()
+        finally:
+            self.executor.shutdown()
+            self.futures = {}
+
+class CopyJobs(list):
+    """
+    Records the copies instead of doing them so that
+    worker processes can hand them to the CopyQueue
+    of the main process.
+    """
+    def copy(self, src, dst, mode="copy"):
+        self.append((src, dst, mode))
+
+# Mirrors all files below src into dst
+def sync_tree(src, dst, mode="copy"):
+    for root, _, files in os.walk(src):
+        out_dir = os.path.join(dst, os.path.relpath(root, src))
+        
+        for name in files:
+            create_copy(os.path.join(root, name), os.path.join(out_dir, name), mode)
+
+# Changes whenever a file is modified or replaced
+def stat_signature(st):
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+def file_signature(path):
+    try:
+        return stat_signature(os.stat(path))
+    except OSError:
+        return None
+
+# Hex digest of the contents of a file or None
+# if the file cannot be read
+def hash_file(path):
+    h = hashlib.sha256()
+    
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    
+    return h.hexdigest()
@@ -0,0 +1,229 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# How long to wait for more events after the first
+# one so that editors that write a file in several
+# steps trigger only one rebuild
+DEBOUNCE = 0.02
+POLL_INTERVAL = 0.1
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+def is_below(path, dirs):
+    for dir in dirs:
+        if path == dir or path.startswith(dir + os.sep):
+            return True
+    return False
+
+class InotifyWatcher:
+    """
+    Reports changed files below a set of directories
+    with the inotify API of Linux. Directories that are
+    created later on are watched as well.
+    """
+    def __init__(self, dirs, files, ignored):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        
+        self.dirs = dirs
+        self.ignored = ignored
+        self.files = set(files)
+        self.watches = {}
+        
+        for dir in dirs:
+            self.watch_tree(dir)
+        
+        # Single files are watched through their directory
+        for file in self.files:
+            self.watch_dir(os.path.dirname(file))
+    
+    def watch_dir(self, dir):
+        wd = self._add_watch(self.fd, os.fsencode(dir), WATCH_MASK)
+        
+        if wd < 0:
+            err = ctypes.get_errno()
+            
+            if err in [errno.ENOENT, errno.ENOTDIR]:
+                return
+            raise OSError(err, f"Cannot watch {dir}")
+        
+        self.watches[wd] = dir
+    
+    def watch_tree(self, dir):
+        changed = set()
+        
+        for root, dirs, files in os.walk(dir):
+            if is_below(root, self.ignored):
+                dirs.clear()
+                continue
+            
+            self.watch_dir(root)
+            changed.update(os.path.join(root, name) for name in files)
+        
+        return changed
+    
+    def read_events(self):
+        changed = set()
+        data = os.read(self.fd, 65536)
+        offset = 0
+        
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            
+            if mask & IN_Q_OVERFLOW:
+                # We lost events, act as if everything changed
+                changed.update(self.watches.values())
+                continue
+            
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            
+            if wd not in self.watches:
+                continue
+            
+            path = os.path.join(self.watches[wd], os.fsdecode(name)) if name else self.watches[wd]
+            
+            if is_below(path, self.ignored):
+                continue
+            
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and is_below(path, self.dirs):
+                    # Pick up everything that landed in the new directory
+                    # before we managed to watch it
+                    changed.update(self.watch_tree(path))
+                continue
+            
+            changed.add(path)
+        
+        return changed
+    
+    # Returns nothing if timeout seconds pass without a change
+    def wait(self, timeout=None):
+        changed = set()
+        
+        while not changed:
+            if not select.select([self.fd], [], [], timeout)[0]:
+                return changed
+            
+            changed.update(self.read_events())
+        
+        while select.select([self.fd], [], [], DEBOUNCE)[0]:
+            changed.update(self.read_events())
+        
+        return changed
+
+class PollingWatcher:
+    """
+    Fallback for platforms without inotify: compares the
+    mtimes and sizes of all files in regular intervals.
+    """
+    def __init__(self, dirs, files, ignored):
+        self.dirs = dirs
+        self.files = files
+        self.ignored = ignored
+        self.snapshot = self.take_snapshot()
+    
+    def take_snapshot(self):
+        ret = {}
+        
+        def add(path):
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            ret[path] = (st.st_mtime_ns, st.st_size)
+        
+        for dir in self.dirs:
+            for root, dirs, files in os.walk(dir):
+                if is_below(root, self.ignored):
+                    dirs.clear()
+                    continue
+                
+                for name in files:
+                    add(os.path.join(root, name))
+        
+        for file in self.files:
+            add(file)
+        
+        return ret
+    
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            
+            time.sleep(POLL_INTERVAL)
+            snapshot = self.take_snapshot()
+            changed = set()
+            
+            for path in snapshot.keys() | self.snapshot.keys():
+                if snapshot.get(path) != self.snapshot.get(path):
+                    changed.add(path)
+            
+            self.snapshot = snapshot
+            
+            if changed:
+                return changed
+
+def create_watcher(dirs, files, ignored):
+    dirs = [os.path.abspath(dir) for dir in dirs]
+    files = [os.path.abspath(file) for file in files]
+    ignored = [os.path.abspath(dir) for dir in ignored]
+    
+    try:
+        return InotifyWatcher(dirs, files, ignored)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher(dirs, files, ignored)
+
+class DependencyGraph:
+    """
+    Maps input files to the outputs that have to be
+    generated again when they change. Outputs are tuples
+    like ("post", filename), ("catlist", category) or
+    ("index",).
+    """
+    def __init__(self):
+        self.dependents = {}
+    
+    def add(self, input, output):
+        self.dependents.setdefault(os.path.abspath(input), set()).add(output)
+    
+    def remove_output(self, output):
+        for outputs in self.dependents.values():
+            outputs.discard(output)
+    
+    def affected(self, changed):
+        ret = set()
+        
+        for path in changed:
+            ret.update(self.dependents.get(os.path.abspath(path), ()))
+        
+        return ret